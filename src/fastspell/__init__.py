@@ -1,7 +1,11 @@
 #!/usr/bin/env python
-from importlib.metadata import version
-
 name="fastspell"
-__version__ = version(name)
 
-from .fastspell import FastSpell
+def __getattr__(attr):
+    # importlib.metadata is slow to import, look the version up only when it is used
+    if attr == "__version__":
+        from importlib.metadata import version
+        return version(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {attr!r}")
+
+from .fastspell import FastSpell, MultiFastSpell, Identification
@@ -2,48 +2,168 @@
 import os
 import io
 import sys
-import fasttext
-import hunspell
 import logging
-import urllib.request
-import pathlib
 import timeit
 import argparse
-import traceback
-import logging
-import hanzidentifier
+import functools
+import copy
+import json
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Mapping
+from itertools import islice
+
+# fasttext, hunspell, hanzidentifier, multiprocessing and urllib.request
+# are imported on first use, they are slow to import and not needed
+# by every command (e.g. --help) or every target language
 
 try:
-    from . import __version__
-    from .util import logging_setup, remove_unwanted_words, get_hash, check_dir, load_config
+    from .fastspell_compile import CompiledDictionary, find_compiled_dict
+    from .util import add_counters, open_input, open_output, logging_setup, tokenize, BoundedCache, get_hash, read_hash_stamp, write_hash_stamp, check_dir, load_config, load_script_tables, search_hunspell_dict
+    from .util import similar_lists, compression_from_path, is_compressed, parse_shard, shard_range, seek_line, read_lines_until, read_checkpoint, write_checkpoint
 except ImportError:
-    from fastspell import __version__
-    from util import logging_setup, remove_unwanted_words, get_hash, check_dir, load_config
-
-fasttext.FastText.eprint = lambda x: None
+    from fastspell_compile import CompiledDictionary, find_compiled_dict
+    from util import add_counters, open_input, open_output, logging_setup, tokenize, BoundedCache, get_hash, read_hash_stamp, write_hash_stamp, check_dir, load_config, load_script_tables, search_hunspell_dict
+    from util import similar_lists, compression_from_path, is_compressed, parse_shard, shard_range, seek_line, read_lines_until, read_checkpoint, write_checkpoint
 
 HBS_LANGS = ('hbs', 'sh', 'bs', 'sr', 'hr', 'me')
 
+logger = logging.getLogger()
+
+# Process-wide registry of loaded Hunspell objects by dictionary path,
+# shared by all FastSpell instances
+hunspell_registry = {}
+hunspell_registry_lock = threading.Lock()
+
+def load_hunspell_dict(dicpath):
+    ''' Load a Hunspell dictionary, or return it if it was already loaded in this process '''
+    with hunspell_registry_lock:
+        if dicpath not in hunspell_registry:
+            import hunspell
+            dirname, lang_code = os.path.split(dicpath)
+            try:
+                hunspell_registry[dicpath] = hunspell.Hunspell(lang_code, hunspell_data_dir=dirname)
+                logging.debug(f"Loaded hunspell obj for '{lang_code}' in path: {dicpath}")
+            except:
+                logging.error("Failed building Hunspell object for " + lang_code)
+                logging.error("Aborting.")
+                exit(1)
+        return hunspell_registry[dicpath]
+
+def load_fasttext_model(path):
+    ''' Load a FastText model, without fasttext warnings '''
+    import fasttext
+    fasttext.FastText.eprint = lambda x: None
+    return fasttext.load_model(path)
+
+def package_version():
+    ''' Installed version, importlib.metadata is imported only if asked for '''
+    from importlib.metadata import version
+    return version("fastspell")
+
+class VersionAction(argparse.Action):
+    ''' Same as action='version', looking up the version only when the option is used '''
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print(f"{parser.prog} {package_version()}")
+        parser.exit()
+
+
+def load_compiled_dict(fsdpath, dicpath):
+    ''' Load a compiled dictionary, None if it can't be used instead of the Hunspell one '''
+    with hunspell_registry_lock:
+        if fsdpath not in hunspell_registry:
+            compiled = None
+            try:
+                compiled = CompiledDictionary(fsdpath)
+                if not compiled.matches(dicpath):
+                    logging.warning(f"Compiled dictionary {fsdpath} does not match {dicpath},"
+                                    f" using Hunspell. Please, execute 'fastspell-compile'.")
+                    compiled.close()
+                    compiled = None
+                else:
+                    logging.debug(f"Loaded compiled dictionary {fsdpath}")
+            except (OSError, ValueError) as ex:
+                logging.warning(f"Could not load compiled dictionary {fsdpath}, using Hunspell: {ex}")
+            hunspell_registry[fsdpath] = compiled
+        return hunspell_registry[fsdpath]
+
+
+class LazyHunspellDicts(Mapping):
+    ''' Hunspell objects of each language, loaded the first time they are accessed '''
+    def __init__(self, dicpaths, compiled_paths=None):
+        self.dicpaths = dicpaths
+        self.compiled_paths = compiled_paths or {}
+
+    def __getitem__(self, lang):
+        # Compiled dictionaries are used if there is one and it is up to date
+        if lang in self.compiled_paths:
+            compiled = load_compiled_dict(self.compiled_paths[lang], self.dicpaths[lang])
+            if compiled is not None:
+                return compiled
+        return load_hunspell_dict(self.dicpaths[lang])
+
+    def __contains__(self, lang):
+        return lang in self.dicpaths
+
+    def __iter__(self):
+        return iter(self.dicpaths)
+
+    def __len__(self):
+        return len(self.dicpaths)
+
 
 def initialization():
     parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), formatter_class=argparse.ArgumentDefaultsHelpFormatter, description=__doc__)
-    parser.add_argument('lang', type=str)
-    parser.add_argument('input',  nargs='?', type=argparse.FileType('rt', errors="replace"), default=io.TextIOWrapper(sys.stdin.buffer, errors="replace"),  help="Input sentences.")
-    parser.add_argument('output', nargs='?', type=argparse.FileType('wt'), default=sys.stdout, help="Output of the language identification.")
+    parser.add_argument('lang', type=str, help="Target language. Several comma-separated targets (e.g. 'es,gl,ca') output one label column per target")
+    parser.add_argument('input',  nargs='?', type=str, default='-', help="Input sentences ('-' for stdin). Gzip, zstd and xz compressed input is detected automatically.")
+    parser.add_argument('output', nargs='?', type=str, default='-', help="Output of the language identification ('-' for stdout). Compressed if it ends in .gz, .zst or .xz.")
 
     parser.add_argument('-c', '--config_path', default=None, type=check_dir, help="Alternative config path. Must contain 'hunspell.yaml' and 'similar.yaml'.")
     parser.add_argument('--aggr', action='store_true', help='Aggressive strategy (more positives)')
     parser.add_argument('--cons', action='store_true',  help='Conservative strategy (less positives)')
     parser.add_argument('--hbs', action='store_true',  help="Tag all Serbo-Croatian variants as 'hbs'")
     parser.add_argument('--script', action='store_true',  help="Detect writing script (currently only Serbo-Croatian is supported)")
+    parser.add_argument('--skip_model_check', action='store_true', help="Do not verify the integrity of the FastText model (e.g. for pinned installations)")
+    parser.add_argument('--spell_cache_size', type=int, default=65536, help="Number of spellchecked tokens cached per dictionary (0 to disable)")
+    parser.add_argument('--sent_cache_size', type=int, default=0, help="Number of identified sentences cached, useful for inputs with many duplicates (0 to disable)")
+    parser.add_argument('--sent_cache_policy', choices=BoundedCache.policies, default="lru", help="Eviction policy of the sentence cache")
+    parser.add_argument('-f', '--field', type=int, default=None, help="Identify the text in this TSV column (starting at 1) and pass the rest of the columns through untouched")
+    parser.add_argument('--label_only', action='store_true', help="Write only the label column(s) instead of the input line and the labels")
+    parser.add_argument('--target_only', action='store_true', help="Write only the lines identified as the target language (any of them if several)")
+    parser.add_argument('--scores', action='store_true', help="Add columns with the FastText probability, the top-k FastText candidates and the Hunspell error rates of each target")
+    parser.add_argument('--top_k', type=int, default=3, help="Number of FastText candidates written with --scores or --jsonl")
+    parser.add_argument('--jsonl', action='store_true', help="Write a JSON object per line with the text, labels, FastText candidates and Hunspell error rates instead of TSV")
+    parser.add_argument('--buffer_size', type=int, default=1<<20, help="Size in bytes of the input and output buffers")
+    parser.add_argument('--spell_backend', choices=FastSpell.spell_backends, default="hunspell", help="Spellcheck with Hunspell, or with the dictionaries compiled by fastspell-compile when available (shared memory across processes)")
+    parser.add_argument('--early_exit', action='store_true', help="Stop spellchecking a similar language once it can't be chosen. Labels are the same, faster on long sentences")
+    parser.add_argument('--max_tokens', type=int, default=0, help="Maximum tokens spellchecked per sentence, evenly sampled from longer ones (0 for all). Labels of longer sentences may change")
+    parser.add_argument('--skip_confidence', type=float, default=0.0, help="Skip Hunspell refinement when the FastText probability is at least this (0 to always refine). Labels may change")
+    parser.add_argument('--skip_min_words', type=int, default=0, help="Only skip refinement (see --skip_confidence) for sentences with at least this number of words")
+    parser.add_argument('--stats', action='store_true', help="Collect timing per stage and refinement counters, and log a summary at the end")
+    parser.add_argument('--trace', type=str, default=None, help="Write a JSON line per identified sentence with tokens, error rates and refinement decision to this file")
+    parser.add_argument('-b', '--batch_size', type=int, default=1000, help="Number of lines sent to FastText in each prediction call")
+    parser.add_argument('-p', '--processes', type=int, default=1, help="Number of worker processes. Each one processes a batch at a time and output keeps the input order")
+
+    groupR = parser.add_argument_group('Ranges and checkpoints')
+    groupR.add_argument('--start_byte', type=int, default=0, help="Process the lines starting at or after this input byte offset")
+    groupR.add_argument('--end_byte', type=int, default=None, help="Process the lines starting before this input byte offset (default: end of the file)")
+    groupR.add_argument('--shard', type=parse_shard, default=None, help="Process the i-th of N equally sized byte ranges of the input ('i/N', from 1/N to N/N). Every line belongs to exactly one shard")
+    groupR.add_argument('--checkpoint', type=str, default=None, help="Periodically record the input and output offsets in this file and, if it exists, resume from it")
+    groupR.add_argument('--checkpoint_interval', type=float, default=60, help="Seconds between checkpoints")
 
     groupL = parser.add_argument_group('Logging')
     groupL.add_argument('-q', '--quiet', action='store_true', help='Silent logging mode')
     groupL.add_argument('--debug', action='store_true', help='Debug logging mode')
     groupL.add_argument('--logfile', type=argparse.FileType('a'), default=sys.stderr, help="Store log to a file")
-    groupL.add_argument('-v', '--version', action='version', version="%(prog)s " + __version__, help="show version of this script and exit")
+    groupL.add_argument('-v', '--version', action=VersionAction, help="show version of this script and exit")
 
-    args = parser.parse_args()
+    args = parser.parse_intermixed_args()
     logging_setup(args)
 
     if args.aggr == args.cons:
@@ -51,66 +171,183 @@ def initialization():
         logging.error("Please provide  --aggr or --cons")
         exit(1)
 
-    if args.script and args.lang not in HBS_LANGS:
+    if args.input != '-' and not os.path.exists(args.input):
+        logging.error(f"Input file '{args.input}' does not exist")
+        exit(1)
+
+    if args.field is not None and args.field < 1:
+        logging.error("Field must be a positive number")
+        exit(1)
+
+    if args.buffer_size < 1:
+        logging.error("Buffer size must be a positive number")
+        exit(1)
+
+    if args.batch_size < 1:
+        logging.error("Batch size must be a positive number")
+        exit(1)
+
+    if args.spell_cache_size < 0:
+        logging.error("Spell cache size must be zero or a positive number")
+        exit(1)
+
+    if args.sent_cache_size < 0:
+        logging.error("Sentence cache size must be zero or a positive number")
+        exit(1)
+
+    if args.top_k < 1:
+        logging.error("Top-k must be a positive number")
+        exit(1)
+
+    if not 0 <= args.skip_confidence <= 1:
+        logging.error("Skip confidence must be a probability between 0 and 1")
+        exit(1)
+
+    if args.skip_min_words < 0:
+        logging.error("Skip minimum words must be zero or a positive number")
+        exit(1)
+
+    if args.max_tokens < 0:
+        logging.error("Maximum tokens must be zero or a positive number")
+        exit(1)
+
+    if args.processes < 1:
+        logging.error("Number of processes must be a positive number")
+        exit(1)
+
+    if args.start_byte < 0 or (args.end_byte is not None and args.end_byte < args.start_byte):
+        logging.error("Byte range must be positive, with --end_byte not before --start_byte")
+        exit(1)
+
+    if args.shard is not None and (args.start_byte or args.end_byte is not None):
+        logging.error("--shard can't be combined with --start_byte or --end_byte")
+        exit(1)
+
+    # Offsets are positions in the input file, they can't be seeked in stdin or compressed files
+    args.ranged = bool(args.shard or args.start_byte or args.end_byte is not None or args.checkpoint)
+    if args.ranged and (args.input == '-' or is_compressed(args.input)):
+        logging.error("Byte ranges, shards and checkpoints need an uncompressed input file")
+        exit(1)
+
+    if args.checkpoint_interval < 0:
+        logging.error("Checkpoint interval must be zero or a positive number")
+        exit(1)
+
+    if args.checkpoint and (args.output == '-' or compression_from_path(args.output)):
+        logging.error("Checkpoints need an uncompressed output file")
+        exit(1)
+
+    args.langs = args.lang.split(',')
+    if args.script and not any(lang in HBS_LANGS for lang in args.langs):
         logging.warning("Script detection is only supported with Serbo-Croatian")
 
     return args
 
+@dataclass
+class Identification:
+    ''' Label of a sentence along with the FastText scores and Hunspell error rates that decided it '''
+    label: str
+    prediction: str # FastText language
+    probability: float # FastText probability of the prediction
+    candidates: list = field(default_factory=list) # Top-k FastText (language, probability) pairs
+    error_rates: dict = field(default_factory=dict) # Hunspell error rate of each similar language, None if it stopped early
+    decision: str = "fasttext" # How the refinement decided the label
+
+
 class FastSpell:
 
     threshold = 0.5 #Hunspell max error rate allowed in a sentence
+    early_exit_chunk = 8 #Tokens spellchecked between early exit checks
+    spell_backends = ("hunspell", "compiled")
     prefix = "__label__" #FastText returns langs labeled as __label__LANGCODE
     ft_model_hash = "01810bc59c6a3d2b79c79e6336612f65"
     ft_download_url = "https://dl.fbaipublicfiles.com/fasttext/supervised-models/lid.176.bin"
 
 
     def __init__(self, lang, config_path=None,
-                 mode="cons", hbs=False, script=False):
+                 mode="cons", hbs=False, script=False, verify_model=True,
+                 spell_cache_size=65536, sent_cache_size=0, sent_cache_policy="lru",
+                 model=None, lazy_dicts=True, stats=False, trace=None,
+                 early_exit=False, max_tokens=0, spell_backend="hunspell",
+                 skip_confidence=0.0, skip_min_words=0):
         assert (mode=="cons" or mode=="aggr"), "Unknown mode. Use 'aggr' for aggressive or 'cons' for conservative"
+        assert spell_backend in self.spell_backends, f"Unknown spell backend. Use one of {self.spell_backends}"
 
         self.lang = lang
         self.mode = mode
         self.hbs = hbs
         self.script = script
+        # Model verification can also be disabled with $FASTSPELL_SKIP_MODEL_CHECK
+        self.verify_model = verify_model and not os.environ.get("FASTSPELL_SKIP_MODEL_CHECK")
+        self.spell_cache_size = spell_cache_size
+        # Final labels of already identified sentences
+        self.sent_cache = None
+        if sent_cache_size:
+            self.sent_cache = BoundedCache(sent_cache_size, sent_cache_policy)
+
+        self.lazy_dicts = lazy_dicts
+        # Guards stats and trace writes, identification can run in several threads
+        self.lock = threading.Lock()
+        # Per-stage timing and counters, only collected if requested
+        self.stats = None
+        if stats:
+            self.reset_stats()
+        # File-like object where a JSON record of each refined sentence is written
+        self.trace = trace
+        # Stop spellchecking a language once it is decided, same labels
+        self.early_exit = early_exit
+        # Maximum tokens spellchecked per sentence (0 for all), may change labels of longer sentences
+        self.max_tokens = max_tokens
+        # Hunspell or dictionaries compiled with fastspell-compile, if available
+        self.spell_backend = spell_backend
+        # FastText probability (0 to disable) and sentence words above which refinement is skipped
+        self.skip_confidence = skip_confidence
+        self.skip_min_words = skip_min_words
 
         self.cur_path = os.path.dirname(__file__)
-        self.download_fasttext()
+        if model is None:
+            self.download_fasttext()
+        else:
+            self.model = model # Already loaded FastText model
         config = load_config(config_path)
         self.similar_langs, self.hunspell_codes, self.hunspell_paths = config
-        self.load_scripts()
+        self.load_scripts(config_path)
         self.load_hunspell_dicts()
 
 
     def download_fasttext(self):
         ''' Download and check integrity of FastText model '''
-        ft_model_path = os.path.join(self.cur_path, "lid.176.bin") #The model should be in the same directory
-        hash = get_hash(ft_model_path)
-        if hash == self.ft_model_hash:
-            self.model = fasttext.load_model(ft_model_path)  #FastText model
+        ft_model_path = self.fetch_model(os.path.join(self.cur_path, "lid.176.bin"), self.verify_model)
+        self.model = load_fasttext_model(ft_model_path)  #FastText model
+
+
+    @classmethod
+    def fetch_model(cls, ft_model_path=None, verify=True, url=None):
+        ''' Download the FastText model if it is missing or does not match its hash, and return its path '''
+        if ft_model_path is None:
+            ft_model_path = os.path.join(os.path.dirname(__file__), "lid.176.bin") #The model should be in the same directory
+        if not verify and os.path.exists(ft_model_path):
+            logging.debug("Skipping FastText model verification")
+        elif read_hash_stamp(ft_model_path) == cls.ft_model_hash:
+            logging.debug("FastText model already verified")
+        elif os.path.exists(ft_model_path) and get_hash(ft_model_path) == cls.ft_model_hash:
+            write_hash_stamp(ft_model_path, cls.ft_model_hash)
         else:
             logging.warning("Downloading FastText model...")
-            urllib.request.urlretrieve(self.ft_download_url, ft_model_path)
-            self.model = fasttext.load_model(ft_model_path)
+            # Download next to the model and replace it at the end, so it is never left half written
+            import urllib.request
+            urllib.request.urlretrieve(url or cls.ft_download_url, ft_model_path + ".tmp")
+            os.replace(ft_model_path + ".tmp", ft_model_path)
+            if get_hash(ft_model_path) == cls.ft_model_hash:
+                write_hash_stamp(ft_model_path, cls.ft_model_hash)
+            else:
+                logging.warning("Downloaded FastText model does not match the expected hash")
+        return ft_model_path
 
 
     def search_hunspell_dict(self, lang_code):
-        ''' Search in the paths for a hunspell dictionary and load it '''
-        for p in self.hunspell_paths:
-            if os.path.exists(f"{p}/{lang_code}.dic") and os.path.exists(f"{p}/{lang_code}.aff"):
-                try:
-                    dicpath = p + '/' + lang_code
-                    hunspell_obj = hunspell.Hunspell(lang_code, hunspell_data_dir=p)
-                    logging.debug(f"Loaded hunspell obj for '{lang_code}' in path: {dicpath}")
-                    break
-                except:
-                    logging.error("Failed building Hunspell object for " + lang_code)
-                    logging.error("Aborting.")
-                    exit(1)
-        else:
-            raise RuntimeError(f"It does not exist any valid dictionary directory"
-                               f"for {lang_code} in the paths {self.hunspell_paths}."
-                               f"Please, execute 'fastspell-download'.")
-        return hunspell_obj
+        ''' Search in the paths for a hunspell dictionary and return its path (without extension) '''
+        return search_hunspell_dict(lang_code, self.hunspell_paths)
 
 
     def load_hunspell_dicts(self):
@@ -125,68 +362,235 @@ class FastSpell:
 
         # Obtain all the possible lists for the given lang
         # a.k.a the list for each script of the lang
-        self.similar = []
-        for sim_entry in self.similar_langs:
-            if sim_entry.split('_')[0] == self.lang:
-                self.similar.append(self.similar_langs[sim_entry] + [sim_entry])
+        self.similar = similar_lists(self.lang, self.similar_langs)
 
         logging.debug(f"Similar lists for '{self.lang}': {self.similar}")
-        self.hunspell_objs = {}
+        # Dictionaries are only located here, they are loaded
+        # the first time a prediction needs them (unless lazy_dicts is disabled)
+        # and shared with other instances through the process-wide registry
+        self.dicpaths = {}
         for similar_list in self.similar:
             for l in similar_list:
-                if l in self.hunspell_objs:
+                if l in self.dicpaths:
                     continue # Avoid loading one dic twice
-                #load dicts
+                self.dicpaths[l] = self.search_hunspell_dict(self.hunspell_codes[l])
+
+        self.compiled_paths = {}
+        if self.spell_backend == "compiled":
+            for l in self.dicpaths:
+                compiled_path = find_compiled_dict(self.hunspell_codes[l], self.hunspell_paths)
+                if compiled_path is None:
+                    logging.debug(f"There is no compiled dictionary for '{l}', using Hunspell")
+                else:
+                    self.compiled_paths[l] = compiled_path
+        self.hunspell_objs = LazyHunspellDicts(self.dicpaths, self.compiled_paths)
+
+        if not self.lazy_dicts:
+            for l in self.hunspell_objs:
                 logging.debug(f"Loading dictionary for {l}")
-                self.hunspell_objs[l] = self.search_hunspell_dict(self.hunspell_codes[l])
-
-
-    def load_scripts(self):
-        # Crate translate tables for script detection
-        self.script_tables = {
-            "hbs": {
-                # Combination of Gaj's alphabet and Montenegrin Latin
-                # plus unicode chars of double letters
-                'hbs_lat': str.maketrans('', '',
-                    'aAbBcčČćĆdDđĐeEfFgGhHiIjJkKlLmMnNoOpPrRsSšŠŚśtuUvVzZžŽŹźﬁﬂﬆĳœǌ'),
-                # Combination of Serbian Cyrillic and Montenegrin Cyrillic
-                'hbs_cyr': str.maketrans('', '',
-                    'АаБбВвГгДддЂђЕеЖжЗзЗ́з́ИиКкkЛлЉљМмНнЊњОоПпРрСсС́с́ЋћТтУуФфХхЦцЧчШшЩщҵҥӕ'),
-            },
-            "sr": {
-                'sr_cyr': str.maketrans('', '',
-                    'aAbBcčČćĆdDđĐeEfFgGhHiIjJkKlLmMnNoOpPrRsSšŠŚśtuUvVzZžŽŹźﬁﬂﬆĳœǌ'),
-                'sr_cyr': str.maketrans('', '',
-                    'АаБбВвГгДддЂђЕеЖжЗзЗ́з́ИиКкkЛлЉљМмНнЊњОоПпРрСсС́с́ЋћТтУуФфХхЦцЧчШшЩщҵҥӕ'),
-            },
-            "me": {
-                'me_cyr': str.maketrans('', '',
-                    'aAbBcčČćĆdDđĐeEfFgGhHiIjJkKlLmMnNoOpPrRsSšŠŚśtuUvVzZžŽŹźﬁﬂﬆĳœǌ'),
-                'me_cyr': str.maketrans('', '',
-                    'АаБбВвГгДддЂђЕеЖжЗзЗ́з́ИиКкkЛлЉљМмНнЊњОоПпРрСсС́с́ЋћТтУуФфХхЦцЧчШшЩщҵҥӕ'),
-            }
+                self.hunspell_objs[l]
+
+        # Spellchecking functions, cached if requested
+        self.spellers = {l: self.build_speller(l) for l in self.dicpaths}
+
+
+    def build_speller(self, lang):
+        ''' Return a token spellchecking function, with an LRU cache in front of Hunspell '''
+        hunspell_obj = None
+        def spell(token):
+            nonlocal hunspell_obj
+            if hunspell_obj is None:
+                hunspell_obj = self.hunspell_objs[lang]
+            try:
+                return hunspell_obj.spell(token)
+            except UnicodeEncodeError as ex: #...because it sometimes fails here for certain characters
+                logging.debug(ex)
+                return False
+
+        if self.spell_cache_size == 0:
+            return spell
+        return functools.lru_cache(maxsize=self.spell_cache_size)(spell)
+
+
+    def spell_cache_info(self):
+        ''' Hits and misses of the spellchecking cache of each language '''
+        info = {}
+        for l, speller in self.spellers.items():
+            if hasattr(speller, "cache_info"):
+                info[l] = speller.cache_info()._asdict()
+        return info
+
+
+    def reset_stats(self):
+        ''' Start collecting timing and counters from zero '''
+        self.stats = {
+            "sentences": 0, # sentences identified (sentence cache misses)
+            "refined": 0, # sentences that went through Hunspell refinement
+            "time": {"fasttext": 0.0, "script": 0.0, "tokenization": 0.0, "hunspell": 0.0, "zh": 0.0},
+            "spellchecked_tokens": {}, # per language
+            "decisions": {}, # outcome of the refinement
         }
 
 
+    def get_stats(self):
+        ''' Timing and counters collected so far, including caches. None if stats are disabled '''
+        if self.stats is None:
+            return None
+        stats = copy.deepcopy(self.stats)
+        stats["cache"] = self.cache_info()
+        return stats
+
+
+    def cache_info(self):
+        ''' Counters of the spellchecking and sentence caches '''
+        return {"spell": self.spell_cache_info(),
+                "sentence": self.sent_cache.info() if self.sent_cache else {}}
+
+
+    def load_scripts(self, config_path=None):
+        # Lookup tables for script detection, shared by all the instances
+        self.script_tables = load_script_tables(config_path)
+
+
     def getscript(self, sent, lang):
-        # Return as detected script the one that its translate table
-        # deletes more characters
-        script_tables = self.script_tables[lang] # grab script tables of the requested lang
-        best_count = sys.maxsize
-        best_script = None
-        for script in script_tables.keys():
-            count_chars = len(sent.translate(script_tables[script]))
-            if count_chars < best_count:
-                best_count = count_chars
-                best_script = script
+        # Return as detected script the one with more characters in the sentence
+        return self.script_tables[lang].detect(sent)
 
-        return best_script
+
+    def spellcheck_early_exit(self, lang, toks, spellchecked):
+        '''
+        Spellcheck tokens until the language can no longer be kept,
+        or can no longer tie with the best error rate found so far.
+        Returns the results of the tokens checked.
+        '''
+        speller = self.spellers[lang]
+        limit = min(spellchecked.values()) if spellchecked else self.threshold
+        total = len(toks)
+        correct_list = []
+        misses = 0
+        # Check tokens in small chunks to keep the overhead per token low
+        for i in range(0, total, self.early_exit_chunk):
+            chunk = list(map(speller, toks[i:i+self.early_exit_chunk]))
+            correct_list.extend(chunk)
+            misses += chunk.count(False)
+            # Lowest error rate still reachable, computed like the final one
+            if misses == total or (misses and 1-((total-misses)/total) > limit):
+                break
+        return correct_list
 
 
     def getlang(self, sent):
         sent=sent.replace("\n", " ").strip()
-        prediction = self.model.predict(sent.lower(), k=1)[0][0][len(self.prefix):]
+        if self.sent_cache is not None:
+            cached = self.sent_cache.get(sent)
+            if cached is not None:
+                return cached
 
+        if self.stats is not None:
+            start = timeit.default_timer()
+            labels, probs = self.model.predict(sent.lower(), k=1)
+            with self.lock:
+                self.stats["time"]["fasttext"] += timeit.default_timer() - start
+                self.stats["sentences"] += 1
+        else:
+            labels, probs = self.model.predict(sent.lower(), k=1)
+        refined_prediction = self.refine(sent, labels[0][len(self.prefix):], float(probs[0]))
+        if self.sent_cache is not None:
+            self.sent_cache.put(sent, refined_prediction)
+        return refined_prediction
+
+
+    def getlangs(self, sents):
+        ''' Identify a batch of sentences with a single FastText call '''
+        sents = [sent.replace("\n", " ").strip() for sent in sents]
+        if self.sent_cache is None:
+            return self.predict_refine(sents)
+
+        # Only identify sentences not in the cache, each one only once
+        results = [self.sent_cache.get(sent) for sent in sents]
+        misses = [sent for sent, result in zip(sents, results) if result is None]
+        todo = list(dict.fromkeys(misses))
+        # Repeated sentences inside the batch count as cache hits
+        with self.sent_cache.lock:
+            self.sent_cache.hits += len(misses) - len(todo)
+            self.sent_cache.misses -= len(misses) - len(todo)
+
+        refined = dict(zip(todo, self.predict_refine(todo)))
+        for sent, refined_prediction in refined.items():
+            self.sent_cache.put(sent, refined_prediction)
+        return [refined[sent] if result is None else result
+                for sent, result in zip(sents, results)]
+
+
+    def getlangs_threaded(self, sents, executor=None, threads=4, chunk_size=1000):
+        '''
+        Identify a batch of sentences in a pool of threads, sharing this instance.
+        This is safe to call from several threads, but not faster than getlangs:
+        Hunspell holds the GIL while spellchecking. Use processes to scale across cores.
+        An existing concurrent.futures executor can be given instead of a number of threads.
+        '''
+        chunks = [sents[i:i+chunk_size] for i in range(0, len(sents), chunk_size)]
+        if executor is None:
+            with ThreadPoolExecutor(threads) as executor:
+                results = list(executor.map(self.getlangs, chunks))
+        else:
+            results = list(executor.map(self.getlangs, chunks))
+        return [label for chunk in results for label in chunk]
+
+
+    def getlang_scores(self, sent, k=1):
+        ''' Identify a sentence and return an Identification with the top-k FastText candidates '''
+        return self.getlangs_scores([sent], k)[0]
+
+
+    def getlangs_scores(self, sents, k=1):
+        ''' Identify a batch of sentences and return an Identification for each one (the sentence cache is not used) '''
+        sents = [sent.replace("\n", " ").strip() for sent in sents]
+        if not sents:
+            return []
+        labels, probs = self.predict(sents, k)
+        results = []
+        for sent, sent_labels, sent_probs in zip(sents, labels, probs):
+            # Probabilities are float32, and can exceed 1 by FastText smoothing
+            candidates = [(label[len(self.prefix):], min(float(prob), 1.0))
+                          for label, prob in zip(sent_labels, sent_probs)]
+            results.append(self.refine_scores(sent, candidates))
+        return results
+
+
+    def refine_scores(self, sent, candidates):
+        details = {}
+        label = self.refine(sent, candidates[0][0], candidates[0][1], details)
+        return Identification(label, candidates[0][0], candidates[0][1], candidates,
+                              details["error_rates"], details["decision"])
+
+
+    def predict(self, sents, k=1):
+        ''' FastText labels and probabilities of already normalized sentences, in a single call '''
+        start = timeit.default_timer()
+        labels, probs = self.model.predict([sent.lower() for sent in sents], k=k)
+        if self.stats is not None:
+            with self.lock:
+                self.stats["time"]["fasttext"] += timeit.default_timer() - start
+                self.stats["sentences"] += len(sents)
+        return labels, probs
+
+
+    def predict_refine(self, sents):
+        ''' Predict already normalized sentences with a single FastText call and refine them '''
+        if not sents:
+            return []
+        labels, probs = self.predict(sents)
+        return [self.refine(sent, label[0][len(self.prefix):], float(prob[0]))
+                for sent, label, prob in zip(sents, labels, probs)]
+
+
+    def refine(self, sent, prediction, probability=None, details=None):
+        '''
+        Apply script detection and Hunspell refinement to a FastText prediction
+        (skipped if FastText is confident enough, see skip_confidence).
+        If a details dict is given, the error rates and the decision are stored in it.
+        '''
         # Return 'hbs' for all serbo-croatian variants
         # if hbs mode is enabled or hbs is the requested language
         if (self.hbs or self.lang == 'hbs') and prediction in HBS_LANGS:
@@ -202,17 +606,38 @@ class FastSpell:
             prediction = "iw"
 
 
+        # Counters of this sentence, added to the stats at the end
+        stats = None
+        if self.stats is not None:
+            stats = {"refined": 0, "time": dict.fromkeys(self.stats["time"], 0.0),
+                     "spellchecked_tokens": {}, "decisions": {}}
+        trace = self.trace
+        # Instance attributes are not modified, so that one instance can be used from several threads
+        keep_script = self.script
+        # Diagnostic messages are only built if debug logging is enabled
+        debug = logger.isEnabledFor(logging.DEBUG)
         # Always detect script if supported (will be printed only if requested)
         script = ''
         if prediction in self.script_tables:
+            if stats is not None:
+                start = timeit.default_timer()
             prediction = self.getscript(sent, prediction)
-            logging.debug(f"Detected script {prediction}")
-
-        #TODO: Confidence score?
+            if debug:
+                logging.debug(f"Detected script {prediction}")
+            if stats is not None:
+                stats["time"]["script"] += timeit.default_timer() - start
 
+        toks = None
+        error_rates = {}
         if self.similar == [] or prediction not in self.hunspell_objs:
         #Non mistakeable language: just return FastText prediction
             refined_prediction = prediction
+            decision = "fasttext"
+        elif (self.skip_confidence and probability is not None and probability >= self.skip_confidence
+                and len(sent.split()) >= self.skip_min_words):
+        #FastText is confident enough: trust it without spellchecking
+            refined_prediction = prediction
+            decision = "confident"
         else:
         #The target language is mistakeable
             # Obtain the list of languages to spellcheck, only similar for the current lang and script
@@ -221,36 +646,56 @@ class FastSpell:
                 if prediction in sim_list or f'{prediction}_{script}' in sim_list:
                     current_similar = sim_list
 
+            if stats is not None:
+                stats["refined"] += 1
+                start = timeit.default_timer()
+            # Tokens only depend on the sentence and the target language
+            # so they are computed once and checked against every dictionary
+            toks = tokenize(sent, self.lang)
+            if debug:
+                logging.debug("Tokens: " +str(toks))
+            if stats is not None:
+                stats["time"]["tokenization"] += timeit.default_timer() - start
+                start = timeit.default_timer()
+
+            if self.max_tokens and len(toks) > self.max_tokens:
+                # Spellcheck an evenly spaced sample of the tokens of long sentences
+                toks = toks[::-(-len(toks) // self.max_tokens)]
+
             spellchecked = {}
             for l in current_similar:
                 #Get spellchecking for all the mistakeable languages
-                logging.debug(l)
-                dec_sent = sent.encode(encoding='UTF-8',errors='strict').decode('UTF-8') #Not 100% sure about this...
-                raw_toks = sent.strip().split(" ")
-                toks = remove_unwanted_words(raw_toks, self.lang)
-                #spellcheck_map = map_except(self.hunspell_objs[l].spell, toks)
-                correct_list = []
-                for token in toks:
-                    try:
-                        correct_list.append(self.hunspell_objs[l].spell(token))                                 
-                        #correct_list = list(map(self.hunspell_objs[l].spell, toks))
-                    except UnicodeEncodeError as ex: #...because it sometimes fails here for certain characters
-                        logging.debug(ex)
-                        correct_list.append(False)
+                if self.early_exit:
+                    correct_list = self.spellcheck_early_exit(l, toks, spellchecked)
+                else:
+                    correct_list = list(map(self.spellers[l], toks))
+                if stats is not None:
+                    tokens = stats["spellchecked_tokens"]
+                    tokens[l] = tokens.get(l, 0) + len(correct_list)
                 corrects = sum(correct_list*1)
-                logging.debug("Tokens: " +str(toks))
-                logging.debug("Corrects: " + str(correct_list))
-                logging.debug("Total: " + str(len(toks)))
-                if corrects > 0:
+                if len(correct_list) < len(toks):
+                    # Stopped early, it can't be kept or be the best
+                    error_rate = None
+                elif corrects > 0:
                     error_rate = 1-(corrects/len(toks))
                 else:
-                    error_rate = 1
-                logging.debug("error_rate: " + str(error_rate))
-                if error_rate <= self.threshold: #we don't keep it if the error rate is above the threshold
+                    error_rate = 1.0
+                if debug:
+                    logging.debug(l)
+                    logging.debug("Corrects: " + str(correct_list))
+                    logging.debug("Total: " + str(len(toks)))
+                    logging.debug("error_rate: " + str(error_rate))
+                    logging.debug("----------------")
+                if trace is not None or details is not None:
+                    error_rates[l] = error_rate
+                if error_rate is not None and error_rate <= self.threshold: #we don't keep it if the error rate is above the threshold
                     spellchecked[l] =  error_rate
-                logging.debug("----------------")
 
-            logging.debug(f"Spellchecked: {spellchecked}")
+            if debug:
+                logging.debug(f"Spellchecked: {spellchecked}")
+            if stats is not None:
+                stats["time"]["hunspell"] += timeit.default_timer() - start
+
             if len(spellchecked) > 0:
                 #at least one of the spellchecks was below the threshold            
                 #get best values and keys
@@ -259,30 +704,38 @@ class FastSpell:
                 if len(best_keys)==1:
                     #Only one language scoring the best
                     refined_prediction = best_keys[0]
+                    decision = "best"
                 else:
                     #It's a tie!
                     if self.mode == "aggr":
                         #Aggressive approach: if the targetted language is among the best scoring, take it
                         if self.lang in best_keys:
                             refined_prediction = self.lang
+                            decision = "tie_target"
                         elif prediction in best_keys:
                             #the targetted language is not in the best ones, and the prediction?
                             refined_prediction = prediction
+                            decision = "tie_prediction"
                         else:
                             #Just take one
                             refined_prediction = best_keys[0]
+                            decision = "tie_first"
                     if self.mode == "cons":
                         #Conservative: just keep it as unknown, unless the  error_rate is 0.0 for the targetted language
                         if self.lang in best_keys and best_value == 0:
                             refined_prediction = self.lang
+                            decision = "tie_target"
                         else:
                             refined_prediction = "unk"
+                            decision = "tie_unk"
             else:
                 #Nothing in the spellchecking list
                 if self.mode == "aggr":
                     refined_prediction = prediction
+                    decision = "none_prediction"
                 else:
                     refined_prediction = "unk"
+                    decision = "none_unk"
 
         # If script detection not requested
         # remove it from prediction
@@ -290,8 +743,11 @@ class FastSpell:
         #Special case for Simplified vs Traditional Chinese
         
         if refined_prediction == "zh":
+            import hanzidentifier
+            if stats is not None:
+                start = timeit.default_timer()
             if self.lang.lower()  in [ "zh-hans", "zh_hans" ]:
-                self.script = True
+                keep_script = True
                 if hanzidentifier.is_simplified(sent.strip()):
                     refined_prediction = "zh_Hans"
                 elif hanzidentifier.is_traditional(sent.strip()):
@@ -300,7 +756,7 @@ class FastSpell:
                     refined_prediction = "zh"                                
                     
             elif self.lang.lower() in [ "zh-hant", "zh_hant" ]:
-                self.script = True
+                keep_script = True
                 if hanzidentifier.is_traditional(sent.strip()):
                     refined_prediction = "zh_Hant"
                 elif hanzidentifier.is_simplified(sent.strip()):
@@ -310,29 +766,417 @@ class FastSpell:
                 
             else:
                 refined_prediction =  "zh"
-                
-        if self.script:
-            return refined_prediction
+            if stats is not None:
+                stats["time"]["zh"] += timeit.default_timer() - start
+
+        if keep_script:
+            label = refined_prediction
         else:
-            return refined_prediction.split('_')[0]
+            label = refined_prediction.split('_')[0]
+
+        if stats is not None:
+            if decision != "fasttext":
+                stats["decisions"][decision] = 1
+            with self.lock:
+                add_counters(self.stats, stats)
+        if details is not None:
+            details["error_rates"] = error_rates
+            details["decision"] = decision
+        if trace is not None:
+            record = json.dumps({
+                "target": self.lang,
+                "sentence": sent,
+                "prediction": prediction,
+                "tokens": toks,
+                "error_rates": error_rates,
+                "decision": decision,
+                "label": label,
+            }, ensure_ascii=False) + "\n"
+            with self.lock:
+                trace.write(record)
+        return label
+
+
+class MultiFastSpell(FastSpell):
+    '''
+    Identify sentences against several target languages in one pass.
+    FastText prediction is done once per sentence and refined for each target,
+    all the targets share the FastText model and the spellchecking caches.
+    Labels are returned as a tuple with one label per target.
+    '''
+
+    def __init__(self, langs, config_path=None,
+                 mode="cons", hbs=False, script=False, verify_model=True,
+                 spell_cache_size=65536, sent_cache_size=0, sent_cache_policy="lru",
+                 model=None, lazy_dicts=True, stats=False, trace=None,
+                 early_exit=False, max_tokens=0, spell_backend="hunspell",
+                 skip_confidence=0.0, skip_min_words=0):
+        assert len(langs) > 0, "At least one target language is needed"
+
+        self.langs = list(langs)
+        self.lang = ",".join(self.langs)
+        self.lock = threading.Lock()
+        self.sent_cache = None
+        if sent_cache_size:
+            self.sent_cache = BoundedCache(sent_cache_size, sent_cache_policy)
+
+        self.targets = []
+        self.model = model
+        for lang in self.langs:
+            fs = FastSpell(lang, config_path=config_path, mode=mode, hbs=hbs, script=script,
+                           verify_model=verify_model, spell_cache_size=spell_cache_size,
+                           model=self.model, lazy_dicts=lazy_dicts, stats=stats,
+                           early_exit=early_exit, max_tokens=max_tokens,
+                           spell_backend=spell_backend,
+                           skip_confidence=skip_confidence, skip_min_words=skip_min_words)
+            self.model = fs.model
+            # Targets write to the same trace
+            fs.lock = self.lock
+            self.targets.append(fs)
+
+        self.stats = None
+        if stats:
+            self.reset_stats()
+
+        # Share the spellchecking caches of the same dictionary across targets
+        spellers = {}
+        for fs in self.targets:
+            for l in fs.spellers:
+                fs.spellers[l] = spellers.setdefault(fs.dicpaths[l], fs.spellers[l])
+
+        self.trace = trace
+
+
+    @property
+    def trace(self):
+        return self._trace
+
+
+    @trace.setter
+    def trace(self, sink):
+        # Every target writes its own records to the same sink
+        self._trace = sink
+        for fs in self.targets:
+            fs.trace = sink
+
+
+    def refine(self, sent, prediction, probability=None):
+        return tuple(fs.refine(sent, prediction, probability) for fs in self.targets)
+
+
+    def refine_scores(self, sent, candidates):
+        return tuple(fs.refine_scores(sent, candidates) for fs in self.targets)
+
+
+    def spell_cache_info(self):
+        info = {}
+        for fs in self.targets:
+            info.update(fs.spell_cache_info())
+        return info
+
+
+    def reset_stats(self):
+        super().reset_stats()
+        for fs in self.targets:
+            fs.reset_stats()
+
+
+    def get_stats(self):
+        # FastText stats are collected here, refinement stats by each target
+        stats = super().get_stats()
+        if stats is not None:
+            stats["targets"] = {}
+            for fs in self.targets:
+                target_stats = fs.get_stats()
+                del target_stats["cache"]
+                stats["targets"][fs.lang] = target_stats
+        return stats
+
+
+# FastSpell object and CLI arguments used by worker processes
+# they are created by the parent before forking, so the FastText model
+# and Hunspell dictionaries are loaded once and shared copy-on-write
+worker_fs = None
+worker_args = None
+
+def is_target(label, lang):
+    ''' Whether a label corresponds to the target language, with or without script '''
+    label = label.lower()
+    lang = lang.lower().replace('-', '_')
+    return label == lang or label.split('_')[0] == lang
+
+def format_scores(results):
+    ''' TSV columns with the FastText probability and candidates, and the error rates of each target '''
+    first = results[0]
+    columns = [f"{first.probability:.4f}",
+               ",".join(f"{lang}:{prob:.4f}" for lang, prob in first.candidates)]
+    for result in results:
+        columns.append(",".join(f"{lang}:{'-' if rate is None else format(rate, '.4f')}"
+                                for lang, rate in result.error_rates.items()))
+    return "\t".join(columns)
+
+def format_json(sent, results, langs):
+    first = results[0]
+    record = {"text": sent,
+              "prediction": first.prediction,
+              "probability": first.probability,
+              "candidates": first.candidates}
+    if len(langs) == 1:
+        record.update(label=first.label, error_rates=first.error_rates, decision=first.decision)
+    else:
+        record["targets"] = {lang: {"label": result.label, "error_rates": result.error_rates, "decision": result.decision}
+                             for lang, result in zip(langs, results)}
+    return json.dumps(record, ensure_ascii=False)
+
+def identify_batch(fs, lines, args):
+    ''' Identify a batch of input lines and return the formatted output, as bytes '''
+    if args.field is None:
+        sents = [line.decode("utf-8", errors="replace").strip() for line in lines]
+        rows = [sent.encode("utf-8") for sent in sents]
+    else:
+        # Only decode the requested column, the rest are written back as they are
+        rows = [line.rstrip(b"\r\n") for line in lines]
+        sents = []
+        for row in rows:
+            columns = row.split(b"\t")
+            if len(columns) >= args.field:
+                sents.append(columns[args.field-1].decode("utf-8", errors="replace"))
+            else:
+                sents.append("")
+
+    multi = isinstance(fs, MultiFastSpell)
+    langs = fs.langs if multi else [fs.lang]
+    scores = None
+    if args.scores or args.jsonl:
+        # Labels and scores come from the same FastText call
+        scores = fs.getlangs_scores(sents, args.top_k)
+        if not multi:
+            scores = [(result,) for result in scores]
+        lidents = [tuple(result.label for result in results) for results in scores]
+    else:
+        lidents = fs.getlangs(sents)
+        if not multi:
+            lidents = [(lident,) for lident in lidents]
+
+    output = []
+    for i, (row, labels) in enumerate(zip(rows, lidents)):
+        if args.target_only and not any(is_target(label, lang) for label, lang in zip(labels, langs)):
+            continue
+        if args.jsonl:
+            output.append(format_json(sents[i], scores[i], langs).encode("utf-8") + b"\n")
+            continue
+        # One column per target language
+        label_columns = "\t".join(labels)
+        if scores is not None:
+            label_columns += "\t" + format_scores(scores[i])
+        label_columns = label_columns.encode("utf-8")
+        if args.label_only:
+            output.append(label_columns + b"\n")
+        else:
+            output.append(row + b"\t" + label_columns + b"\n")
+    return b"".join(output)
+
+def worker_identify_batch(lines):
+    # Send back the cache counters, stats and trace of this worker along with the output
+    trace = None
+    if worker_args.trace:
+        trace = worker_fs.trace = io.StringIO()
+    output = identify_batch(worker_fs, lines, worker_args)
+    trace = trace.getvalue() if trace is not None else None
+    return output, os.getpid(), worker_fs.cache_info(), worker_fs.get_stats(), trace
+
+
+def sum_counters(infos):
+    ''' Sum (nested) counters across processes '''
+    total = {}
+    for info in infos:
+        add_counters(total, info)
+    return total
+
+def hit_rate(counters):
+    lookups = counters["hits"] + counters["misses"]
+    return counters["hits"] / lookups if lookups else 0.0
+
+
+def log_stats(stats):
+    ''' Log a summary of the timing and counters collected by FastSpell '''
+    if "targets" in stats:
+        # Multi-target: refinement stats are per target
+        for lang, target_stats in stats["targets"].items():
+            log_stats_target(lang, target_stats, stats["sentences"])
+        logging.info(f"Stats: {stats['sentences']} sentences identified,"
+                     f" FastText time {stats['time']['fasttext']:.3f}s")
+    else:
+        log_stats_target(None, stats, stats["sentences"])
+
+def log_stats_target(lang, stats, sentences):
+    prefix = f"Stats '{lang}'" if lang else "Stats"
+    refined_rate = stats["refined"] / sentences if sentences else 0.0
+    logging.info(f"{prefix}: {sentences} sentences identified, {stats['refined']} refined with Hunspell ({refined_rate:.3f})")
+    # FastText is not run by each target in multi-target mode
+    times = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in stats["time"].items()
+                      if not (lang and stage == "fasttext"))
+    logging.info(f"{prefix} time per stage: {times}")
+    if stats["spellchecked_tokens"]:
+        tokens = ", ".join(f"{l} {n}" for l, n in stats["spellchecked_tokens"].items())
+        logging.info(f"{prefix} spellchecked tokens: {tokens}")
+    if stats["decisions"]:
+        decisions = ", ".join(f"{d} {n}" for d, n in stats["decisions"].items())
+        logging.info(f"{prefix} refinement decisions: {decisions}")
+
+
+def load_checkpoint(args, start, end):
+    ''' Resume from the checkpoint of a previous run over the same input range, or start a new one '''
+    st = os.stat(args.input)
+    run = {"input": os.path.abspath(args.input), "input_size": st.st_size, "input_mtime": st.st_mtime_ns,
+           "output": os.path.abspath(args.output), "start_byte": start, "end_byte": end}
+    checkpoint = read_checkpoint(args.checkpoint)
+    if checkpoint is None:
+        return dict(run, input_offset=start, output_offset=0, done=False)
+
+    if any(checkpoint.get(key) != value for key, value in run.items()):
+        logging.error(f"Checkpoint '{args.checkpoint}' belongs to a different input, output or range. Remove it to start over")
+        exit(1)
+    if not os.path.exists(args.output) or os.path.getsize(args.output) < checkpoint["output_offset"]:
+        logging.error(f"Output file '{args.output}' is shorter than recorded in checkpoint '{args.checkpoint}'. Remove it to start over")
+        exit(1)
+    logging.info(f"Resuming from checkpoint '{args.checkpoint}' at input byte {checkpoint['input_offset']},"
+                 f" output byte {checkpoint['output_offset']}")
+    return checkpoint
 
 
 def perform_identification(args):
+    global worker_fs, worker_args
     time_start = timeit.default_timer()
     if args.aggr:
         mode="aggr"
     if args.cons:
         mode="cons"
 
-    fs = FastSpell(args.lang, mode=mode, config_path=args.config_path,
-                   hbs=args.hbs, script=args.script)
+    options = dict(mode=mode, config_path=args.config_path,
+                   hbs=args.hbs, script=args.script,
+                   verify_model=not args.skip_model_check,
+                   spell_cache_size=args.spell_cache_size,
+                   sent_cache_size=args.sent_cache_size,
+                   sent_cache_policy=args.sent_cache_policy,
+                   # Workers share the dictionaries loaded by the parent
+                   lazy_dicts=args.processes == 1,
+                   stats=args.stats,
+                   early_exit=args.early_exit,
+                   max_tokens=args.max_tokens,
+                   spell_backend=args.spell_backend,
+                   skip_confidence=args.skip_confidence,
+                   skip_min_words=args.skip_min_words)
+    trace_file = None
+    if args.trace:
+        trace_file = open(args.trace, "w", encoding="utf-8")
+    if len(args.langs) > 1:
+        fs = MultiFastSpell(args.langs, **options)
+    else:
+        fs = FastSpell(args.lang, **options)
+
+    input_file = open_input(args.input, args.buffer_size)
+    input_lines = input_file
+    checkpoint = None
+    if args.ranged:
+        start, end = args.start_byte, args.end_byte
+        if args.shard:
+            start, end = shard_range(os.path.getsize(args.input), *args.shard)
+        if args.checkpoint:
+            checkpoint = load_checkpoint(args, start, end)
+            start = checkpoint["input_offset"]
+        position = seek_line(input_file, start)
+        logging.info(f"Processing input from byte {position} to {end if end is not None else 'the end'}")
+        input_lines = read_lines_until(input_file, position, end)
 
-    for line in args.input:
-        lident = fs.getlang(line)
-        args.output.write(line.strip()+"\t"+lident+"\n")
+    if checkpoint is not None and checkpoint["output_offset"]:
+        # Drop whatever was written after the last checkpoint
+        output_file = open(args.output, 'r+b', buffering=args.buffer_size)
+        output_file.truncate(checkpoint["output_offset"])
+        output_file.seek(checkpoint["output_offset"])
+    else:
+        output_file = open_output(args.output, args.buffer_size)
+
+    last_checkpoint = timeit.default_timer()
+    def write_output(output, input_offset):
+        nonlocal last_checkpoint
+        output_file.write(output)
+        if checkpoint is None:
+            return
+        checkpoint["input_offset"] = input_offset
+        checkpoint["output_offset"] += len(output)
+        if timeit.default_timer() - last_checkpoint >= args.checkpoint_interval:
+            # Only record offsets whose output is already on disk
+            output_file.flush()
+            os.fsync(output_file.fileno())
+            write_checkpoint(args.checkpoint, checkpoint)
+            last_checkpoint = timeit.default_timer()
+
+    # Read input in chunks and identify each one with a single FastText call
+    # along with the input offset after each chunk, for checkpoints
+    def read_batches():
+        while True:
+            batch = list(islice(input_lines, args.batch_size))
+            if not batch:
+                break
+            yield batch, input_file.tell() if checkpoint is not None else None
+    batches = read_batches()
+    if args.processes == 1:
+        fs.trace = trace_file
+        for lines, input_offset in batches:
+            write_output(identify_batch(fs, lines, args), input_offset)
+        cache_infos = [fs.cache_info()]
+        stats = [fs.get_stats()]
+    else:
+        worker_fs, worker_args = fs, args
+        # Latest cache counters and stats of each worker
+        worker_infos = {}
+        worker_stats = {}
+        def write_result(result, input_offset):
+            output, pid, info, stats, trace = result.get()
+            write_output(output, input_offset)
+            if trace is not None:
+                trace_file.write(trace)
+            worker_infos[pid] = info
+            worker_stats[pid] = stats
+
+        import multiprocessing
+        with multiprocessing.get_context("fork").Pool(args.processes) as pool:
+            # Keep a bounded number of batches in flight
+            # and write results in the same order they were read
+            pending = deque()
+            for lines, input_offset in batches:
+                pending.append((pool.apply_async(worker_identify_batch, (lines,)), input_offset))
+                if len(pending) >= 2 * args.processes:
+                    write_result(*pending.popleft())
+            while pending:
+                write_result(*pending.popleft())
+        cache_infos = worker_infos.values()
+        stats = worker_stats.values()
+    input_file.close()
+    if checkpoint is not None:
+        output_file.flush()
+        os.fsync(output_file.fileno())
+        checkpoint["done"] = True
+        write_checkpoint(args.checkpoint, checkpoint)
+    output_file.close()
+    if trace_file is not None:
+        trace_file.close()
 
     end_time = timeit.default_timer()
-    logging.info("Elapsed time: {}".format(end_time - time_start))
+    if args.stats:
+        log_stats(sum_counters(stats))
+    spell_counters = sum_counters(info["spell"] for info in cache_infos)
+    for l, counters in spell_counters.items():
+        logging.info(f"Spell cache '{l}': {counters['hits']} hits, {counters['misses']} misses,"
+                     f" hit rate {hit_rate(counters):.3f}")
+
+    if args.sent_cache_size:
+        sent_counters = sum_counters({"sentence": info["sentence"]} for info in cache_infos)
+        logging.info("Elapsed time: {}, sentence cache hit rate: {:.3f}".format(
+            end_time - time_start, hit_rate(sent_counters.get("sentence", {"hits": 0, "misses": 0}))))
+    else:
+        logging.info("Elapsed time: {}".format(end_time - time_start))
 
 
 def main():
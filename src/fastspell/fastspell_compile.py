@@ -0,0 +1,796 @@
+#!/usr/bin/env python
+'''
+Compile Hunspell dictionaries into memory-mapped word form tables.
+
+Each dictionary is expanded with its affix rules into the full set of
+accepted word forms, stored sorted and front-coded (each form only keeps
+what it does not share with the previous one) in a file (<code>.fsd)
+that is memory-mapped at runtime, so all the worker processes share the
+same pages.
+Forms are sorted in runs written to temporary files next to the output
+and merged, so memory does not grow with the size of the dictionary, and
+each dictionary is compiled in its own process.
+Dictionaries using Hunspell features that can't be expanded into a finite
+set of forms (compounding, circumfixes, ...), or with more forms than
+--max_forms (estimated from a sample of their words before expanding
+them), are not compiled and FastSpell keeps using Hunspell for them.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from tempfile import TemporaryDirectory
+from bisect import bisect_right
+import multiprocessing
+import argparse
+import logging
+import heapq
+import struct
+import json
+import mmap
+import zlib
+import sys
+import os
+import re
+
+try:
+    from .util import logging_setup, load_config, search_hunspell_dict
+except ImportError:
+    from util import logging_setup, load_config, search_hunspell_dict
+
+MAGIC = b"FSPD"
+VERSION = 3
+# magic, version, metadata length, number of blocks, index offset, words offset
+# Words follow the header, then the index and then the metadata
+HEADER = struct.Struct("<4sIIQQQ")
+# Offset of each block from the words offset, followed by the end of the words
+INDEX_ENTRY = struct.Struct("<I")
+BLOCK_RANGE = struct.Struct("<II")
+# Length of the prefix shared with the previous form (7 bits) and kind (high bit), suffix length
+ENTRY = struct.Struct("<BB")
+# Forms per block. The first one of each block is stored whole, to binary search the blocks
+BLOCK_SIZE = 8
+MAX_SHARED = 0x7F
+# Longer forms (in UTF-8 bytes) are left out
+MAX_LENGTH = 0xFF
+# The first form of one of every TOP_STEP blocks is kept in memory,
+# to narrow down the binary search without reading the file
+TOP_STEP = 16
+
+# Word forms sorted in memory at once, each run of them goes to a temporary file
+RUN_SIZE = 1 << 20
+# Dictionary words expanded to estimate the number of word forms before compiling
+ESTIMATE_SAMPLES = 2000
+# Larger dictionaries (e.g. Italian, Arabic) take several minutes and hundreds of MB
+DEFAULT_MAX_FORMS = 15000000
+
+# Kinds of word forms
+NORMAL = 0
+# Forms of mixed case words in lowercase and capitalized, not accepted for capitalized input
+# (e.g. OpenOffice -> Openoffice, only to accept OPENOFFICE)
+ONLYUPCASE = 1
+
+# Affix file options that can't be expanded into a set of word forms
+UNSUPPORTED_OPTIONS = (
+    "COMPOUNDFLAG", "COMPOUNDBEGIN", "COMPOUNDMIDDLE", "COMPOUNDEND", "COMPOUNDRULE",
+    "ONLYINCOMPOUND", "CIRCUMFIX", "KEEPCASE", "CHECKSHARPS", "FORCEUCASE",
+    "COMPLEXPREFIXES",
+)
+# Languages with special casing rules in Hunspell
+UNSUPPORTED_LANGS = ("tr", "az", "crh", "hu")
+
+DEFAULT_BREAK = ["-", "^-", "-$"]
+
+
+class UnsupportedDictionary(Exception):
+    pass
+
+
+def dictionary_checksum(dicpath):
+    ''' Sizes and CRC32 of the .aff and .dic files, to detect outdated compiled files '''
+    checksum = {}
+    for ext in ("aff", "dic"):
+        crc = 0
+        with open(f"{dicpath}.{ext}", "rb") as source:
+            for chunk in iter(lambda: source.read(1 << 20), b""):
+                crc = zlib.crc32(chunk, crc)
+        checksum[ext] = [os.path.getsize(f"{dicpath}.{ext}"), crc]
+    return checksum
+
+
+class AffixRule:
+    def __init__(self, kind, strip, add, contclass, condition, cross):
+        self.kind = kind
+        self.strip = strip
+        self.add = add
+        self.contclass = contclass
+        self.cross = cross
+        if condition == ".":
+            self.condition = None
+        else:
+            pattern = condition_regex(condition)
+            self.condition = re.compile(pattern + "$" if kind == "SFX" else "^" + pattern)
+
+    def apply(self, word, fullstrip):
+        ''' Affixed form of a word, or None if the rule does not apply to it '''
+        if len(word) < len(self.strip) or (len(word) == len(self.strip) and not fullstrip):
+            return None
+        if self.kind == "SFX":
+            if not word.endswith(self.strip):
+                return None
+            if self.condition is not None and not self.condition.search(word):
+                return None
+            return word[:len(word)-len(self.strip)] + self.add
+        if not word.startswith(self.strip):
+            return None
+        if self.condition is not None and not self.condition.search(word):
+            return None
+        return self.add + word[len(self.strip):]
+
+
+def condition_regex(condition):
+    ''' Regular expression of an affix condition, made of characters, '.' and [...] or [^...] groups '''
+    pattern = []
+    i = 0
+    while i < len(condition):
+        c = condition[i]
+        if c == "[":
+            end = condition.find("]", i)
+            if end == -1:
+                raise UnsupportedDictionary(f"Malformed affix condition '{condition}'")
+            group = condition[i+1:end]
+            negated = group.startswith("^")
+            if negated:
+                group = group[1:]
+            pattern.append("[" + ("^" if negated else "") + "".join(re.escape(g) for g in group) + "]")
+            i = end + 1
+            continue
+        pattern.append("." if c == "." else re.escape(c))
+        i += 1
+    return "".join(pattern)
+
+
+class AffixFile:
+    ''' The subset of a Hunspell .aff file needed to expand a dictionary '''
+
+    def __init__(self, path):
+        with open(path, "rb") as aff_file:
+            raw = aff_file.read()
+        self.encoding = "iso8859-1"
+        for line in raw.splitlines():
+            fields = line.split()
+            if len(fields) >= 2 and fields[0] == b"SET":
+                self.encoding = fields[1].decode("ascii", errors="replace")
+                break
+        if self.encoding.lower().startswith("microsoft-"):
+            self.encoding = self.encoding[len("microsoft-"):]
+        try:
+            text = raw.decode(self.encoding, errors="replace")
+        except LookupError:
+            raise UnsupportedDictionary(f"Unknown encoding '{self.encoding}'")
+
+        self.flag_type = "char"
+        self.aliases = []
+        self.affixes = {} # flag -> list of AffixRule
+        self.cross = {} # flag -> whether it can be combined with affixes of the other kind
+        self.needaffix = None
+        self.forbiddenword = None
+        self.fullstrip = False
+        self.iconv = []
+        self.ignore = ""
+        self.wordbreak = None
+        options = []
+        alias_header = False
+        lines = [l.split() for l in text.splitlines()]
+        # Flag type is needed to parse the other options
+        for fields in lines:
+            if len(fields) >= 2 and fields[0] == "FLAG":
+                self.flag_type = fields[1].lower()
+        for fields in lines:
+            if not fields or fields[0].startswith("#"):
+                continue
+            option = fields[0]
+            options.append(option)
+            if option in ("PFX", "SFX") and len(fields) >= 4:
+                self.parse_affix(option, fields)
+            elif option == "AF" and len(fields) >= 2:
+                # First line is the number of aliases
+                if alias_header:
+                    self.aliases.append(self.parse_flags(fields[1], aliases=False))
+                alias_header = True
+            elif option in ("NEEDAFFIX", "PSEUDOROOT") and len(fields) >= 2:
+                self.needaffix = self.parse_flags(fields[1], aliases=False)[0]
+            elif option == "FORBIDDENWORD" and len(fields) >= 2:
+                self.forbiddenword = self.parse_flags(fields[1], aliases=False)[0]
+            elif option == "FULLSTRIP":
+                self.fullstrip = True
+            elif option == "ICONV" and len(fields) >= 3:
+                self.iconv.append((fields[1], fields[2]))
+            elif option == "IGNORE" and len(fields) >= 2:
+                self.ignore = fields[1]
+            elif option == "BREAK" and len(fields) >= 2:
+                if self.wordbreak is None:
+                    self.wordbreak = []
+                else:
+                    self.wordbreak.append(fields[1])
+            elif option == "LANG" and len(fields) >= 2 and fields[1].split("_")[0] in UNSUPPORTED_LANGS:
+                raise UnsupportedDictionary(f"LANG {fields[1]} has special casing rules")
+
+        unsupported = sorted(set(options).intersection(UNSUPPORTED_OPTIONS))
+        if unsupported:
+            raise UnsupportedDictionary(f"Uses {', '.join(unsupported)}")
+        if self.wordbreak is None:
+            self.wordbreak = DEFAULT_BREAK
+
+    def parse_flags(self, flags, aliases=True):
+        if aliases and self.aliases and flags.isdigit():
+            index = int(flags)
+            if not 0 < index <= len(self.aliases):
+                raise UnsupportedDictionary(f"Unknown flag alias {flags}")
+            return self.aliases[index-1]
+        if self.flag_type == "long":
+            return [flags[i:i+2] for i in range(0, len(flags), 2)]
+        if self.flag_type == "num":
+            return [f for f in flags.split(",") if f]
+        return list(flags)
+
+    def parse_affix(self, kind, fields):
+        flag = self.parse_flags(fields[1], aliases=False)[0]
+        if flag not in self.affixes:
+            # Header: PFX/SFX flag cross_product number_of_rules
+            self.affixes[flag] = []
+            self.cross[flag] = fields[2] == "Y"
+            return
+        if len(fields) < 4:
+            return
+        strip = "" if fields[2] == "0" else fields[2]
+        add, _, contclass = fields[3].partition("/")
+        add = "" if add == "0" else add
+        contclass = set(self.parse_flags(contclass)) if contclass else set()
+        condition = fields[4] if len(fields) >= 5 else "."
+        if self.ignore:
+            add = remove_chars(add, self.ignore)
+            strip = remove_chars(strip, self.ignore)
+        self.affixes[flag].append(AffixRule(kind, strip, add, contclass, condition, self.cross[flag]))
+
+    def rules(self, flags, kind):
+        for flag in flags:
+            for rule in self.affixes.get(flag, ()):
+                if rule.kind == kind:
+                    yield rule
+
+
+def remove_chars(word, chars):
+    return word.translate({ord(c): None for c in chars})
+
+
+def split_entry(line):
+    ''' Word and flags of a .dic line, without morphological fields '''
+    # Morphological fields are separated by tabs or by spaces before 'xx:' fields
+    entry = re.split(r"\t| +(?=\S\S:)", line, maxsplit=1)[0].strip()
+    word = []
+    i = 0
+    while i < len(entry):
+        if entry[i] == "\\" and i + 1 < len(entry) and entry[i+1] == "/":
+            word.append("/")
+            i += 2
+            continue
+        if entry[i] == "/" and i > 0:
+            return "".join(word), entry[i+1:]
+        word.append(entry[i])
+        i += 1
+    return "".join(word), ""
+
+
+def captype(word):
+    ''' Capitalization type of a word, like Hunspell does '''
+    ncap = 0
+    nneutral = 0
+    for c in word:
+        if c.lower() != c:
+            ncap += 1
+        if c.upper() == c.lower():
+            nneutral += 1
+    if ncap == 0:
+        return "nocap"
+    if ncap == 1 and word[0].lower() != word[0]:
+        return "initcap"
+    if ncap == len(word) or ncap + nneutral == len(word):
+        return "allcap"
+    if ncap > 1 and word[0].lower() != word[0]:
+        return "huhinitcap"
+    return "huhcap"
+
+
+def initcap(word):
+    return word[:1].upper() + word[1:]
+
+
+def expand_word(aff, word, flags):
+    ''' All the forms of a dictionary word, and whether each one is forbidden '''
+    fullstrip = aff.fullstrip
+    if aff.needaffix not in flags:
+        yield word, False
+    suffixed = []
+    twofold = []
+    for sfx in aff.rules(flags, "SFX"):
+        form = sfx.apply(word, fullstrip)
+        if form is None:
+            continue
+        suffixed.append((sfx, form))
+        if aff.needaffix not in sfx.contclass:
+            yield form, aff.forbiddenword in sfx.contclass
+        # Twofold suffixes
+        for sfx2 in aff.rules(sfx.contclass, "SFX"):
+            form2 = sfx2.apply(form, fullstrip)
+            if form2 is not None:
+                twofold.append((sfx, sfx2, form2))
+                yield form2, aff.forbiddenword in sfx2.contclass
+    for pfx in aff.rules(flags, "PFX"):
+        form = pfx.apply(word, fullstrip)
+        if form is None:
+            continue
+        if aff.needaffix not in pfx.contclass:
+            yield form, aff.forbiddenword in pfx.contclass
+        # Prefix and suffix: both cross products, or the suffix allowed by the prefix
+        allowed = set(aff.rules(pfx.contclass, "SFX")) if pfx.contclass else ()
+        for sfx, suffixed_form in suffixed:
+            if not ((pfx.cross and sfx.cross) or sfx in allowed):
+                continue
+            if not suffixed_form.startswith(pfx.strip):
+                continue
+            yield pfx.add + suffixed_form[len(pfx.strip):], aff.forbiddenword in sfx.contclass
+    # Prefixes allowed by a suffix
+    for sfx, suffixed_form in suffixed:
+        for pfx in aff.rules(sfx.contclass, "PFX"):
+            if pfx.apply(word, fullstrip) is None or not suffixed_form.startswith(pfx.strip):
+                continue
+            yield pfx.add + suffixed_form[len(pfx.strip):], aff.forbiddenword in sfx.contclass
+    # Prefix and twofold suffixes: cross products of the prefix and the second suffix, with the prefix allowed
+    # by the second suffix, or by the word or the first suffix if it is a cross product too
+    for sfx, sfx2, form2 in twofold:
+        if not sfx2.cross:
+            continue
+        prefixes = list(aff.rules(sfx2.contclass, "PFX"))
+        if sfx.cross:
+            prefixes.extend(aff.rules(flags | sfx.contclass, "PFX"))
+        for pfx in prefixes:
+            form3 = pfx.apply(form2, fullstrip) if pfx.cross else None
+            if form3 is not None:
+                yield form3, aff.forbiddenword in sfx2.contclass
+
+
+def parse_entry(aff, line):
+    ''' Word and flags of a .dic line, None if it has no word '''
+    line = line.rstrip("\n")
+    if not line.strip() or line.startswith("\t") or line.startswith("#"):
+        return None
+    word, flags = split_entry(line)
+    if aff.ignore:
+        word = remove_chars(word, aff.ignore)
+    if not word:
+        return None
+    return word, set(aff.parse_flags(flags)) if flags else set()
+
+
+def entry_forms(aff, word, flags):
+    ''' All the forms of a dictionary word and their kind, None for forbidden forms '''
+    if aff.forbiddenword in flags:
+        yield word, None
+        return
+    for form, is_forbidden in expand_word(aff, word, flags):
+        yield form, None if is_forbidden else NORMAL
+    # Hunspell accepts mixed case words in all uppercase
+    # through a hidden capitalized homonym (OpenOffice -> Openoffice -> OPENOFFICE)
+    case = captype(word)
+    if case in ("huhcap", "huhinitcap") or (case == "allcap" and flags):
+        for form, is_forbidden in expand_word(aff, initcap(word.lower()), flags):
+            if not is_forbidden:
+                yield form, ONLYUPCASE
+
+
+def estimate_forms(dicpath, aff, samples=ESTIMATE_SAMPLES, limit=0):
+    ''' Approximate number of word forms, from the forms of evenly spaced dictionary words. Stops once over limit '''
+    with open(f"{dicpath}.dic", encoding=aff.encoding, errors="replace") as dic_file:
+        num_lines = sum(1 for _ in dic_file)
+        step = max(1, num_lines // samples)
+        dic_file.seek(0)
+        next(dic_file, None) # Number of words
+        forms = 0
+        for i, line in enumerate(dic_file):
+            if i % step != 0:
+                continue
+            entry = parse_entry(aff, line)
+            if entry is not None:
+                forms += len({form for form, kind in entry_forms(aff, *entry) if kind is not None})
+                if limit and forms * step > limit:
+                    break
+    return forms * step
+
+
+def write_run(run, tmpdir, number):
+    '''
+    Write a run of forms sorted, one per line followed by a NUL and its kind.
+    Lines sort like their forms, and NORMAL before ONLYUPCASE for the same form.
+    '''
+    path = os.path.join(tmpdir, f"run{number}")
+    with open(path, "wb") as run_file:
+        run_file.writelines(sorted(b"%s\0%d\n" % item for item in run.items()))
+    return path
+
+
+def expand_dictionary(dicpath, aff, tmpdir):
+    '''
+    Expand all the dictionary words into sorted runs of UTF-8 word forms in tmpdir.
+    Returns the paths of the runs and the set of forbidden forms.
+    '''
+    runs = []
+    run = {}
+    forbidden = set()
+    with open(f"{dicpath}.dic", encoding=aff.encoding, errors="replace") as dic_file:
+        next(dic_file, None) # Number of words
+        for line in dic_file:
+            entry = parse_entry(aff, line)
+            if entry is None:
+                continue
+            for form, kind in entry_forms(aff, *entry):
+                form = form.encode("utf-8", errors="surrogatepass")
+                if kind is None:
+                    forbidden.add(form)
+                elif len(form) > MAX_LENGTH or b"\0" in form:
+                    # Hunspell can't match words with NUL either
+                    continue
+                elif kind == NORMAL:
+                    run[form] = NORMAL
+                else:
+                    run.setdefault(form, ONLYUPCASE)
+            if len(run) >= RUN_SIZE:
+                runs.append(write_run(run, tmpdir, len(runs)))
+                run = {}
+    if run:
+        runs.append(write_run(run, tmpdir, len(runs)))
+    return runs, forbidden
+
+
+def merge_runs(paths, forbidden=(), max_forms=0):
+    ''' Sorted word forms and their kind from the runs, a form is NORMAL if it is in any run as such '''
+    run_files = [open(path, "rb") for path in paths]
+    try:
+        count = 0
+        previous = None
+        for line in heapq.merge(*run_files):
+            form = line[:-3]
+            # The first line of a form has the lowest kind
+            if form == previous:
+                continue
+            previous = form
+            if form in forbidden:
+                continue
+            count += 1
+            if max_forms and count > max_forms:
+                raise UnsupportedDictionary(f"More than {max_forms} word forms")
+            yield form, line[-2] - ord("0")
+    finally:
+        for run_file in run_files:
+            run_file.close()
+
+
+def write_compiled(path, forms, metadata):
+    '''
+    Write word forms and their kind, sorted by their UTF-8 bytes, front-coded in blocks of BLOCK_SIZE forms.
+    Returns the number of forms.
+    '''
+    index = bytearray()
+    block = bytearray()
+    size = 0
+    previous = b""
+    count = 0
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as out:
+            # Header is written at the end, when the offsets are known
+            out.write(bytes(HEADER.size))
+            for word, kind in forms:
+                if count % BLOCK_SIZE == 0:
+                    out.write(block)
+                    size += len(block)
+                    block = bytearray()
+                    index += INDEX_ENTRY.pack(size)
+                    shared = 0
+                else:
+                    # Length of the shared prefix: the first differing byte
+                    # is the highest one set in the XOR of both prefixes
+                    limit = min(len(word), len(previous), MAX_SHARED)
+                    diff = int.from_bytes(word[:limit], "big") ^ int.from_bytes(previous[:limit], "big")
+                    shared = limit - (diff.bit_length() + 7) // 8
+                block += ENTRY.pack(kind << 7 | shared, len(word) - shared)
+                block += word[shared:]
+                previous = word
+                count += 1
+            out.write(block)
+            size += len(block)
+
+            if size > 0xFFFFFFFF:
+                raise UnsupportedDictionary("Word forms do not fit in 4GB")
+            nblocks = len(index) // INDEX_ENTRY.size
+            index += INDEX_ENTRY.pack(size)
+            meta = json.dumps(dict(metadata, forms=count), ensure_ascii=False).encode("utf-8")
+            out.write(index)
+            out.write(meta)
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, VERSION, len(meta), nblocks, HEADER.size + size, HEADER.size))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return count
+
+
+def compile_dictionary(dicpath, dest, max_forms=0):
+    ''' Compile a Hunspell dictionary (path without extension) into dest/<code>.fsd '''
+    aff = AffixFile(f"{dicpath}.aff")
+    if max_forms:
+        # Refuse large dictionaries before spending time on them
+        if estimate_forms(dicpath, aff, limit=max_forms) > max_forms:
+            raise UnsupportedDictionary(f"More than {max_forms} word forms (estimated)")
+    metadata = {
+        "source": dictionary_checksum(dicpath),
+        "iconv": aff.iconv,
+        "ignore": aff.ignore,
+        "break": aff.wordbreak,
+    }
+    path = os.path.join(dest, os.path.basename(dicpath) + ".fsd")
+    with TemporaryDirectory(prefix=".fsd-", dir=dest) as tmpdir:
+        runs, forbidden = expand_dictionary(dicpath, aff, tmpdir)
+        num_forms = write_compiled(path, merge_runs(runs, forbidden, max_forms), metadata)
+    return path, num_forms
+
+
+def compile_in_subprocess(dicpath, dest, max_forms=0):
+    ''' Compile a dictionary in a child process, so its memory is returned when it finishes '''
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("fork")) as executor:
+        return executor.submit(compile_dictionary, dicpath, dest, max_forms).result()
+
+
+class CompiledDictionary:
+    '''
+    Spellchecker over a compiled dictionary, with the same spell() interface as Hunspell.
+    Handles capitalization, input conversion, ignored characters, numbers
+    and word breaking (e.g. at hyphens) like Hunspell does.
+    '''
+
+    def __init__(self, path):
+        with open(path, "rb") as fsd_file:
+            self.mm = mmap.mmap(fsd_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, meta_len, self.nblocks, self.index_offset, self.words_offset = HEADER.unpack_from(self.mm, 0)
+        except struct.error:
+            raise ValueError(f"{path} is not a compiled dictionary")
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a compiled dictionary of version {VERSION}")
+        meta_offset = self.index_offset + INDEX_ENTRY.size * (self.nblocks + 1)
+        self.metadata = json.loads(self.mm[meta_offset:meta_offset+meta_len].decode("utf-8"))
+        self.iconv = sorted(self.metadata["iconv"], key=lambda conv: -len(conv[0]))
+        self.iconv_first = {pattern[0] for pattern, _ in self.iconv}
+        self.ignore = {ord(c): None for c in self.metadata["ignore"]}
+        self.wordbreak = self.metadata["break"]
+        self.blocks = range(self.nblocks)
+        self.top = [self.block_word(block) for block in range(0, self.nblocks, TOP_STEP)]
+
+    def matches(self, dicpath):
+        ''' Whether it was compiled from these dictionary files '''
+        return self.metadata["source"] == dictionary_checksum(dicpath)
+
+    def block_word(self, block):
+        ''' First form of a block, which is stored whole '''
+        start = self.words_offset + INDEX_ENTRY.unpack_from(self.mm, self.index_offset + INDEX_ENTRY.size * block)[0]
+        return self.mm[start+ENTRY.size:start+ENTRY.size+self.mm[start+1]]
+
+    def lookup(self, word, initcap=False):
+        ''' Whether a form is in the dictionary. Hidden capitalized stems are not accepted for capitalized input '''
+        encoded = word.encode("utf-8", errors="surrogatepass")
+        # Last block starting at or before the word, first among the ones in memory
+        first = (bisect_right(self.top, encoded) - 1) * TOP_STEP
+        if first < 0:
+            return False
+        block = bisect_right(self.blocks, encoded, first + 1, min(first + TOP_STEP, self.nblocks), key=self.block_word) - 1
+
+        start, end = BLOCK_RANGE.unpack_from(self.mm, self.index_offset + INDEX_ENTRY.size * block)
+        data = self.mm[self.words_offset+start:self.words_offset+end]
+        pos = 0
+        current = b""
+        while pos < len(data):
+            head = data[pos]
+            length = data[pos+1]
+            pos += ENTRY.size
+            current = current[:head & MAX_SHARED] + data[pos:pos+length]
+            pos += length
+            if current == encoded:
+                return not (head >> 7 and initcap)
+            if current > encoded:
+                return False
+        return False
+
+    def convert(self, word):
+        ''' Input conversion table (ICONV), longest pattern first at each position '''
+        if not self.iconv or not self.iconv_first.intersection(word):
+            return word
+        converted = []
+        i = 0
+        while i < len(word):
+            for pattern, replacement in self.iconv:
+                if word.startswith(pattern, i):
+                    converted.append(replacement)
+                    i += len(pattern)
+                    break
+            else:
+                converted.append(word[i])
+                i += 1
+        return "".join(converted)
+
+    def spell(self, word):
+        word = self.convert(word)
+        if self.ignore:
+            word = word.translate(self.ignore)
+        # Trailing dots are not part of the word, but it can be an abbreviation with a dot
+        stripped = word.rstrip(".")
+        if not stripped:
+            # Nothing left to check, Hunspell accepts it
+            return True
+        return self.check(stripped, abbreviation=len(stripped) < len(word))
+
+    def check(self, word, abbreviation=False):
+        if is_number(word):
+            return True
+        # Most of the words are lowercase
+        case = "nocap" if word == word.lower() else captype(word)
+        if case in ("nocap", "huhcap", "huhinitcap"):
+            if self.lookup(word) or (abbreviation and self.lookup(word + ".")):
+                return True
+        else:
+            if case == "allcap" and self.check_allcap(word, abbreviation):
+                return True
+            # Capitalized input and all uppercase input, capitalized.
+            # Hunspell also breaks this form of the word
+            lower = word.lower()
+            word = initcap(lower)
+            if self.lookup(word, initcap=case == "initcap") or self.lookup(lower):
+                return True
+            if abbreviation and (self.lookup(lower + ".") or self.lookup(word + ".", initcap=case == "initcap")):
+                return True
+        return self.check_break(word)
+
+    def check_allcap(self, word, abbreviation):
+        if self.lookup(word) or (abbreviation and self.lookup(word + ".")):
+            return True
+        # Apostrophe handling for Catalan, French, Italian (L'AMIC -> l'Amic, L'Amic)
+        apos = word.find("'")
+        if apos != -1 and apos < len(word) - 1:
+            lower = word.lower()
+            part = lower[:apos+1] + initcap(lower[apos+1:])
+            if self.lookup(part) or self.lookup(initcap(part)):
+                return True
+        return False
+
+    def check_break(self, word):
+        ''' Recursive checking of the parts of a word split at break points, each one as a whole word '''
+        if not self.wordbreak:
+            return False
+        length = len(word)
+        breaks = sum(word.count(pattern) for pattern in self.wordbreak)
+        if breaks >= 10:
+            return False
+        # Boundary patterns
+        for pattern in self.wordbreak:
+            plen = len(pattern)
+            if plen == 1 or plen > length:
+                continue
+            if pattern[0] == "^" and word.startswith(pattern[1:]) and self.spell(word[plen-1:]):
+                return True
+            if pattern[-1] == "$" and word.endswith(pattern[:-1]) and self.spell(word[:length-plen+1]):
+                return True
+        # Break points inside the word, at the second occurrence first
+        # to recognize dictionary words with break characters, then at the first one
+        for second in (True, False):
+            for pattern in self.wordbreak:
+                plen = len(pattern)
+                found = word.find(pattern)
+                if not 0 < found < length - plen:
+                    continue
+                if second:
+                    found2 = word.find(pattern, found + 1)
+                    if 0 < found2 < length - plen:
+                        found = found2
+                if self.spell(word[found+plen:]) and self.spell(word[:found]):
+                    return True
+        return False
+
+    def close(self):
+        self.mm.close()
+
+
+def is_number(word):
+    ''' Numbers with dots, dashes and commas, but not double separators '''
+    state = "begin"
+    for i, c in enumerate(word):
+        if "0" <= c <= "9":
+            state = "num"
+        elif c in ",.-":
+            if state == "sep" or i == 0:
+                return False
+            state = "sep"
+        else:
+            return False
+    return state == "num"
+
+
+def find_compiled_dict(lang_code, hunspell_paths):
+    ''' Path of the compiled dictionary in the search paths, None if there is none '''
+    for p in hunspell_paths:
+        path = os.path.join(p, f"{lang_code}.fsd")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    default_dir = os.path.expanduser('~/.local/share/fastspell')
+    parser.add_argument('langs', nargs='*', help="Languages of hunspell.yaml to compile (all by default)")
+    parser.add_argument('-o', '--output_dir', default=default_dir, type=str,
+                        help=f"Directory to write the compiled dictionaries. By default '{default_dir}', where fastspell looks for them")
+    parser.add_argument('-c', '--config_path', default=None, type=str, help="Alternative config path with 'hunspell.yaml'")
+    parser.add_argument('--max_forms', type=int, default=DEFAULT_MAX_FORMS, help="Do not compile dictionaries with more word forms than this, estimated before compiling them (0 for no limit)")
+    parser.add_argument('-f', '--force', action='store_true', help="Compile again dictionaries that are up to date")
+    groupL = parser.add_argument_group('Logging')
+    groupL.add_argument('-q', '--quiet', action='store_true', help='Silent logging mode')
+    groupL.add_argument('--debug', action='store_true', help='Debug logging mode')
+    groupL.add_argument('--logfile', type=argparse.FileType('a'), default=sys.stderr, help="Store log to a file")
+    args = parser.parse_args()
+    logging_setup(args)
+
+    _, hunspell_codes, hunspell_paths = load_config(args.config_path)
+    langs = args.langs or list(hunspell_codes)
+    for lang in langs:
+        if lang not in hunspell_codes:
+            logging.error(f"Language '{lang}' is not in hunspell.yaml")
+            exit(1)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Several languages can share a dictionary
+    codes = {}
+    for lang in langs:
+        codes.setdefault(hunspell_codes[lang], lang)
+    failed = []
+    for code, lang in codes.items():
+        try:
+            dicpath = search_hunspell_dict(code, hunspell_paths)
+        except RuntimeError:
+            logging.warning(f"Dictionary for '{lang}' ({code}) not found, skipping")
+            continue
+
+        compiled_path = os.path.join(args.output_dir, f"{code}.fsd")
+        if not args.force and os.path.exists(compiled_path):
+            try:
+                if CompiledDictionary(compiled_path).matches(dicpath):
+                    logging.info(f"'{lang}' ({code}) is up to date")
+                    continue
+            except ValueError:
+                pass
+
+        try:
+            path, num_forms = compile_in_subprocess(dicpath, args.output_dir, args.max_forms)
+        except UnsupportedDictionary as ex:
+            logging.info(f"'{lang}' ({code}) can't be compiled, Hunspell will be used: {ex}")
+            continue
+        except BrokenProcessPool:
+            logging.error(f"Compiling '{lang}' ({code}) was interrupted, probably out of memory. Hunspell will be used")
+            failed.append(code)
+            continue
+        logging.info(f"Compiled '{lang}' ({code}): {num_forms} word forms in {path}")
+
+    if failed:
+        logging.error(f"Could not compile {len(failed)} dictionaries: {', '.join(failed)}")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
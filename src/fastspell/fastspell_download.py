@@ -1,76 +1,269 @@
 #!/usr/bin/env python
+'''
+Download the FastText model and Hunspell dictionaries.
+
+Dictionaries can be downloaded for some target languages only (with their
+similar languages, as in similar.yaml) or all of them, from the
+fastspell-dictionaries release archive on PyPI or from a mirror: a URL or local directory with
+<code>.dic and <code>.aff files and a SHA256SUMS file, e.g. created with
+'sha256sum *.dic *.aff > SHA256SUMS'. Mirror files are fetched concurrently,
+every file is verified against its checksum and dictionaries are installed
+atomically.
+
+The archive is downloaded in one piece and verified before extracting it:
+the release archive against its pinned checksum, other archives against
+the checksum given with --sha256 or the SHA256SUMS file inside them.
+Other archives with neither are only installed with --insecure.
+'''
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import TemporaryDirectory
-from shutil import copyfile
+from urllib import request
+from urllib.parse import urlparse
 import argparse
+import hashlib
 import logging
+import pathlib
 import tarfile
 import sys
 import os
 
-from urllib import request
-
 try:
     from . import FastSpell
-    from .util import logging_setup, load_config
+    from .util import logging_setup, load_config, similar_lists
 except ImportError:
     from fastspell import FastSpell
-    from util import logging_setup, load_config
+    from util import logging_setup, load_config, similar_lists
+
+# Source distribution of fastspell-dictionaries, the package installed with pip
+DICTIONARIES_URL = "https://files.pythonhosted.org/packages/4a/9b/d95c629a69616dfd050250d5b60e25d589fc25480df82a227d72bddc9825/fastspell_dictionaries-3.4.tar.gz"
+DICTIONARIES_SHA256 = "795e44c8d402f178cfdbb6354f2f4546497c82074641d059b7f4d2cc1df7fde2"
+CHECKSUMS_FILE = "SHA256SUMS"
+
+
+def to_url(location):
+    ''' URLs are kept as they are, local paths are converted to file:// URLs '''
+    if urlparse(location).scheme in ("http", "https", "file", "ftp"):
+        return location
+    return pathlib.Path(os.path.abspath(location)).as_uri()
+
+
+def is_archive(url):
+    return urlparse(url).path.endswith((".tgz", ".tar.gz"))
+
+
+def copy_hashed(source, dest_file=None):
+    ''' Copy a binary stream to a file, if any, and return the sha256 of the contents '''
+    sha256 = hashlib.sha256()
+    while True:
+        chunk = source.read(1<<20)
+        if not chunk:
+            break
+        sha256.update(chunk)
+        if dest_file is not None:
+            dest_file.write(chunk)
+    return sha256.hexdigest()
+
+
+def parse_checksums(text):
+    ''' Parse the output of sha256sum into a dict of file name to hash '''
+    checksums = {}
+    for line in text.splitlines():
+        if line.strip():
+            checksum, name = line.split(maxsplit=1)
+            checksums[name.lstrip("*")] = checksum.lower()
+    return checksums
+
+
+def resolve_lang_codes(langs, similar_langs, hunspell_codes):
+    ''' Dictionary codes needed to identify the target languages: their own and the ones of their similar languages '''
+    lang_codes = {}
+    for lang in langs:
+        lists = similar_lists(lang, similar_langs)
+        if not lists:
+            logging.warning(f"'{lang}' has no similar languages, it does not need dictionaries")
+        for similar_list in lists:
+            for l in similar_list:
+                if l not in hunspell_codes:
+                    raise RuntimeError(f"There is no dictionary for '{l}' in hunspell.yaml")
+                lang_codes[l] = hunspell_codes[l]
+    return lang_codes
+
+
+def missing_dictionaries(dest, lang_codes):
+    ''' Dictionary codes without .dic or .aff file in dest '''
+    missing = []
+    for lang, code in lang_codes.items():
+        if not all(os.path.exists(os.path.join(dest, f"{code}.{ext}")) for ext in ("dic", "aff")):
+            logging.debug(f"Dictionary for {lang} {code} does not exist")
+            missing.append(code)
+    return sorted(set(missing))
+
 
+class DictionaryInstaller:
+    ''' Write dictionary files to temporary files in dest, verify them and install each .dic/.aff pair atomically '''
 
-def download_dictionaries(dest, lang_codes: dict, force=False):
-    ''' Download dictionaries from github '''
-    repo_url = "https://github.com/mbanon/fastspell/releases/download/dictionaries_v1/fastspell_dictionaries.tgz"
+    def __init__(self, dest, checksums=None):
+        self.dest = dest
+        self.checksums = checksums
+
+    def temp_path(self, name):
+        return os.path.join(self.dest, f".{name}.{os.getpid()}.tmp")
+
+    def write(self, name, source):
+        with open(self.temp_path(name), "wb") as temp_file:
+            return copy_hashed(source, temp_file)
+
+    def verify(self, name, checksum):
+        if self.checksums is None:
+            return
+        if name not in self.checksums:
+            raise RuntimeError(f"'{name}' is not in the checksums file")
+        if self.checksums[name] != checksum:
+            raise RuntimeError(f"Checksum of '{name}' does not match, expected {self.checksums[name]} got {checksum}")
+
+    def install(self, code, hashes):
+        ''' Verify the written files of a dictionary and move them to their place, hashes are the sha256 of each written file '''
+        names = [f"{code}.aff", f"{code}.dic"]
+        try:
+            for name in names:
+                if name not in hashes:
+                    raise RuntimeError(f"'{name}' was not downloaded")
+                self.verify(name, hashes[name])
+            # .dic last, as it is the one checked for existence
+            for name in names:
+                os.replace(self.temp_path(name), os.path.join(self.dest, name))
+        finally:
+            self.discard(code)
+        logging.debug(f"Installed hunspell dict '{code}' in {self.dest}")
+
+    def discard(self, code):
+        ''' Remove the temporary files of a dictionary, if any '''
+        for name in (f"{code}.aff", f"{code}.dic"):
+            if os.path.exists(self.temp_path(name)):
+                os.remove(self.temp_path(name))
+
+
+def download_from_mirror(url, dest, codes, jobs=4, timeout=60):
+    ''' Fetch dictionaries concurrently from a mirror with one file per dictionary and a checksums file '''
+    base = url if url.endswith("/") else url + "/"
+    with request.urlopen(base + CHECKSUMS_FILE, timeout=timeout) as response:
+        checksums = parse_checksums(response.read().decode("utf-8"))
+    installer = DictionaryInstaller(dest, checksums)
+
+    def download(code):
+        hashes = {}
+        try:
+            for name in (f"{code}.aff", f"{code}.dic"):
+                with request.urlopen(base + name, timeout=timeout) as response:
+                    hashes[name] = installer.write(name, response)
+        except Exception:
+            installer.discard(code)
+            raise
+        installer.install(code, hashes)
+
+    failed = []
+    with ThreadPoolExecutor(jobs) as executor:
+        futures = {code: executor.submit(download, code) for code in codes}
+        for code, future in futures.items():
+            try:
+                future.result()
+            except Exception as ex:
+                logging.error(f"Could not download dictionary '{code}': {ex}")
+                failed.append(code)
+    return failed
+
+
+def download_from_archive(url, dest, codes, timeout=60, sha256=None, insecure=False):
+    '''
+    Download a dictionaries archive once and install only the requested dictionaries.
+    Files are verified with the SHA256SUMS file of the archive, or with the sha256 of the whole archive if given.
+    If there is no way to verify them, nothing is installed unless insecure is set.
+    '''
+    wanted = {f"{code}.{ext}" for code in codes for ext in ("aff", "dic")}
+    with TemporaryDirectory() as dirname:
+        if urlparse(url).scheme == "file":
+            file_path = request.url2pathname(urlparse(url).path)
+            with open(file_path, "rb") as archive_file:
+                archive_hash = copy_hashed(archive_file)
+        else:
+            logging.info(f"Downloading to tempdir {dirname}")
+            file_path = os.path.join(dirname, "dicts.tgz")
+            with request.urlopen(url, timeout=timeout) as response, open(file_path, "wb") as archive_file:
+                archive_hash = copy_hashed(response, archive_file)
+        # Checked before extracting anything
+        if sha256 is None and archive_hash == DICTIONARIES_SHA256:
+            # A copy of the release archive
+            sha256 = archive_hash
+        if sha256 is not None and archive_hash != sha256.lower():
+            raise RuntimeError(f"Checksum of the archive does not match, expected {sha256} got {archive_hash}")
+
+        # Extract the requested files in a single pass over the compressed archive
+        installer = DictionaryInstaller(dest)
+        hashes = {}
+        try:
+            with tarfile.open(file_path, "r:*") as tar:
+                for member in tar:
+                    name = os.path.basename(member.name)
+                    if not member.isfile():
+                        continue
+                    if name == CHECKSUMS_FILE:
+                        installer.checksums = parse_checksums(tar.extractfile(member).read().decode("utf-8"))
+                    elif name in wanted:
+                        hashes[name] = installer.write(name, tar.extractfile(member))
+            if installer.checksums is None and sha256 is None:
+                if not insecure:
+                    raise RuntimeError(f"The archive has no {CHECKSUMS_FILE} file and its checksum was not given,"
+                                       f" dictionaries can't be verified. Give its sha256 (--sha256) or allow unverified dictionaries (--insecure)")
+                logging.warning(f"The archive has no {CHECKSUMS_FILE} file, installing unverified dictionaries")
+        except BaseException:
+            # Remove the files extracted so far, also when interrupted
+            for code in codes:
+                installer.discard(code)
+            raise
+
+    failed = []
+    for code in codes:
+        try:
+            installer.install(code, hashes)
+        except Exception as ex:
+            logging.error(f"Could not install dictionary '{code}': {ex}")
+            failed.append(code)
+    return failed
+
+
+def download_dictionaries(dest, lang_codes: dict, force=False, url=None, jobs=4, sha256=None, insecure=False):
+    '''
+    Download dictionaries (lang to dictionary code, as in hunspell.yaml) that are missing in dest, or all if forced,
+    from an archive or from a mirror, by default the release archive. Returns the codes that could not be downloaded.
+    sha256 and insecure only apply to other archives, the release archive is always verified against its pinned checksum.
+    '''
+    if url is None or url == DICTIONARIES_URL:
+        url, sha256, insecure = DICTIONARIES_URL, DICTIONARIES_SHA256, False
 
     if not os.path.exists(dest):
         raise RuntimeError(f"Download directory '{dest}' does not exist")
 
-    # Check that dictionaries exist
-    all_correct = True
     logging.debug("Checking existence of hunspell dictionaries.")
-    for lang in lang_codes.keys():
-        dic_dest = os.path.join(dest, f"{lang_codes[lang]}.dic")
-        aff_dest = os.path.join(dest, f"{lang_codes[lang]}.aff")
-        if not os.path.exists(dic_dest) or not os.path.exists(aff_dest):
-            logging.debug(f"Dictionary for {lang} {lang_codes[lang]} does not exist")
-            all_correct = False
-
-    # Download again if something is missing or download is forced
-    if all_correct and not force:
+    if force:
+        codes = sorted(set(lang_codes.values()))
+    else:
+        codes = missing_dictionaries(dest, lang_codes)
+    if not codes:
         logging.info("All dictionaries already exist, finishing. Use --force to force download.")
-        return
+        return []
 
-    with TemporaryDirectory() as dirname:
-        # Download repo zip in tempdir
-        logging.info(f"Downloading to tempdir {dirname}")
-        file_path = os.path.join(dirname, 'dicts.tgz')
-        request.urlretrieve(repo_url, file_path)
-
-        # Extract zip
-        logging.info("Extracting tar")
-        with tarfile.open(file_path) as tar:
-            tar.extractall(path=dirname)
-
-        # Copy dictionaries to path for each lang requested
-        logging.info(f"Copying to {dest}")
-        for lang in lang_codes.keys():
-            cur_dic = os.path.join(dirname, f"{lang_codes[lang]}.dic")
-            cur_aff = os.path.join(dirname, f"{lang_codes[lang]}.aff")
-            if not os.path.exists(cur_dic):
-                logging.warning(f"Could not download dictionary for {lang} {lang_codes[lang]}")
-                continue
-
-            dic_dest = os.path.join(dest, f"{lang_codes[lang]}.dic")
-            aff_dest = os.path.join(dest, f"{lang_codes[lang]}.aff")
-            copyfile(cur_dic, dic_dest)
-            copyfile(cur_aff, aff_dest)
-            logging.debug(f"Copied hunspell dict for '{lang}' to {dic_dest}")
-
-        logging.info("Download finished")
+    url = to_url(url)
+    logging.info(f"Downloading {len(codes)} dictionaries from {url}")
+    if is_archive(url):
+        failed = download_from_archive(url, dest, codes, sha256=sha256, insecure=insecure)
+    else:
+        failed = download_from_mirror(url, dest, codes, jobs)
+    logging.info("Download finished")
+    return failed
 
 
 def main():
-    parser = argparse.ArgumentParser(
-            description="Download Hunspell dictionaries and FastText model")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
 
     default_dir = os.path.expanduser('~/.local/share/fastspell')
     parser.add_argument('download_dir', nargs='?',
@@ -78,7 +271,15 @@ def main():
                         type=str,
                         help='Directory to store downloaded hunspell dictionaries.'
                         f' By default fastspell will use "{default_dir}"')
-    parser.add_argument('-f', '--force', action='store_true', help='Force download of dictionaries')
+    parser.add_argument('-l', '--langs', type=str, default=None, help="Comma-separated target languages to download dictionaries for, along with their similar languages")
+    parser.add_argument('-f', '--force', action='store_true', help='Force download of dictionaries. Without --langs, all of them')
+    parser.add_argument('-u', '--url', type=str, default=None, help="Dictionaries archive (.tgz) or mirror with one file per dictionary and a SHA256SUMS file, instead of the release archive. URL or local path")
+    parser.add_argument('-j', '--jobs', type=int, default=4, help="Concurrent downloads from a mirror")
+    parser.add_argument('--sha256', type=str, default=None, help="Expected sha256 of the dictionaries archive given with --url, to verify archives without a SHA256SUMS file")
+    parser.add_argument('--insecure', action='store_true', help="Install dictionaries from an archive given with --url that can't be verified (no SHA256SUMS file and no --sha256)")
+    parser.add_argument('--model_url', type=str, default=None, help="FastText model URL or local path, instead of the official one")
+    parser.add_argument('--skip_model', action='store_true', help="Do not download the FastText model")
+    parser.add_argument('-c', '--config_path', default=None, type=str, help="Alternative config path, to resolve languages and dictionary codes")
     groupL = parser.add_argument_group('Logging')
     groupL.add_argument('-q', '--quiet', action='store_true', help='Silent logging mode')
     groupL.add_argument('--debug', action='store_true', help='Debug logging mode')
@@ -87,19 +288,42 @@ def main():
     args = parser.parse_args()
     logging_setup(args)
 
-    # Trigger fasttext download
-    dummy = FastSpell(lang='en', mode='aggr')
-    logging.warning("Dictionaries are now installed alongside FastSpell with pip"
-                    " Use '-f' option to force download of dictionaries.")
-    if not args.force:
+    if args.jobs < 1:
+        logging.error("Number of jobs must be a positive number")
+        exit(1)
+    if (args.sha256 or args.insecure) and args.url is None:
+        logging.error("The release archive is verified with its own checksum, --sha256 and --insecure only apply to archives given with --url")
+        exit(1)
+
+    # Download and verify the model, without loading it
+    if not args.skip_model:
+        FastSpell.fetch_model(url=args.model_url and to_url(args.model_url))
+
+    if args.langs is None and not args.force:
+        logging.warning("Dictionaries are now installed alongside FastSpell with pip"
+                        " Use '-f' option to force download of dictionaries, or '-l' to download the ones of some languages.")
         sys.exit(0)
 
     # Load config from yaml files to obtain needed dictionaries
-    _, hunspell_codes, hunspell_paths = load_config()
+    similar_langs, hunspell_codes, _ = load_config(args.config_path)
+    if args.langs is not None:
+        try:
+            hunspell_codes = resolve_lang_codes(args.langs.split(','), similar_langs, hunspell_codes)
+        except RuntimeError as ex:
+            logging.error(ex)
+            exit(1)
     logging.debug(hunspell_codes)
     if args.download_dir == default_dir and not os.path.exists(args.download_dir):
         os.makedirs(args.download_dir, exist_ok=True)
-    download_dictionaries(args.download_dir, hunspell_codes, force=args.force)
+    try:
+        failed = download_dictionaries(args.download_dir, hunspell_codes, force=args.force, url=args.url, jobs=args.jobs,
+                                       sha256=args.sha256, insecure=args.insecure)
+    except RuntimeError as ex:
+        logging.error(ex)
+        exit(1)
+    if failed:
+        logging.error(f"Could not download {len(failed)} dictionaries: {', '.join(failed)}")
+        exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+'''
+Long-lived FastSpell identification service.
+
+Loads FastSpell once per target language and answers requests over a
+Unix socket or TCP with a JSON lines protocol. Sentences of concurrent
+requests for the same target are grouped into a single batched
+prediction, waiting at most --max_latency for more sentences to come.
+
+Request:  {"id": 1, "lang": "es", "texts": ["Hola mundo", "Bos días"]}
+Response: {"id": 1, "labels": ["es", "gl"]}
+"text" can be used instead of "texts" to get a single "label".
+"lang" can be omitted if the server has only one target.
+'''
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import logging
+import asyncio
+import signal
+import socket
+import json
+import sys
+import os
+
+try:
+    from .fastspell import FastSpell, MultiFastSpell
+    from .util import logging_setup, check_dir
+except ImportError:
+    from fastspell import FastSpell, MultiFastSpell
+    from util import logging_setup, check_dir
+
+
+class Batcher:
+    ''' Groups the sentences of concurrent requests for one target into batched identification calls '''
+
+    def __init__(self, fs, batch_size=256, max_latency=0.005):
+        self.fs = fs
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.pending = []
+        self.num_pending = 0
+        self.timer = None
+        # Batches of a target are identified one after another
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def identify(self, sents):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((sents, future))
+        self.num_pending += len(sents)
+        if self.num_pending >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.max_latency, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending, self.num_pending = self.pending, [], 0
+        if not batch:
+            return
+        sents = [sent for request_sents, _ in batch for sent in request_sents]
+        task = asyncio.get_running_loop().run_in_executor(self.executor, self.fs.getlangs, sents)
+        task.add_done_callback(lambda task: self.resolve(batch, task))
+
+    def resolve(self, batch, task):
+        if task.exception() is not None:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(task.exception())
+            return
+        labels = task.result()
+        start = 0
+        for request_sents, future in batch:
+            if not future.done():
+                future.set_result(labels[start:start+len(request_sents)])
+            start += len(request_sents)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+# Longest request line accepted, asyncio streams only accept 64 KiB by default
+MAX_REQUEST_SIZE = 64 << 20
+
+
+class FastSpellServer:
+    ''' JSON lines identification server for a set of already loaded targets '''
+
+    def __init__(self, targets, batch_size=256, max_latency=0.005, max_request_size=MAX_REQUEST_SIZE):
+        assert len(targets) > 0, "At least one target language is needed"
+        self.batchers = {lang: Batcher(fs, batch_size, max_latency) for lang, fs in targets.items()}
+        self.max_request_size = max_request_size
+        self.server = None
+
+    async def start(self, socket_path=None, host="localhost", port=None):
+        ''' Start listening on a Unix socket, or on TCP if no socket is given '''
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.server = await asyncio.start_unix_server(self.handle, path=socket_path, limit=self.max_request_size)
+        else:
+            self.server = await asyncio.start_server(self.handle, host=host, port=port, limit=self.max_request_size)
+        return self.server
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for batcher in self.batchers.values():
+            batcher.close()
+
+    async def handle(self, reader, writer):
+        # Requests of a connection are answered concurrently, possibly out of order
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as ex:
+                    # Last request without line break, or end of the connection
+                    line = ex.partial
+                except asyncio.LimitOverrunError:
+                    # Skip the whole request, so the next ones are still read in order
+                    await self.discard_line(reader)
+                    await self.reply(writer, {"id": None, "error": f"Request longer than {self.max_request_size} bytes"})
+                    continue
+                if not line:
+                    break
+                task = asyncio.ensure_future(self.answer(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def discard_line(self, reader):
+        ''' Consume the rest of a line that is longer than the stream limit '''
+        while True:
+            try:
+                await reader.readuntil(b"\n")
+                return
+            except asyncio.LimitOverrunError as ex:
+                await reader.readexactly(ex.consumed)
+            except asyncio.IncompleteReadError:
+                return
+
+    async def reply(self, writer, response):
+        writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def answer(self, line, writer):
+        response = {}
+        try:
+            request = json.loads(line)
+            response["id"] = request.get("id")
+            response.update(await self.process(request))
+        except (ValueError, TypeError, KeyError, AttributeError) as ex:
+            response["error"] = f"Invalid request: {ex}"
+        except Exception as ex:
+            logging.exception("Identification failed")
+            response["error"] = f"Identification failed: {ex}"
+        await self.reply(writer, response)
+
+    async def process(self, request):
+        lang = request.get("lang")
+        if lang is None and len(self.batchers) == 1:
+            lang = next(iter(self.batchers))
+        if lang not in self.batchers:
+            return {"error": f"Unknown target language '{lang}'. Available: {', '.join(self.batchers)}"}
+        batcher = self.batchers[lang]
+
+        if "texts" in request:
+            sents = request["texts"]
+            if not isinstance(sents, list) or not all(isinstance(s, str) for s in sents):
+                raise TypeError("'texts' must be a list of strings")
+            if not sents:
+                return {"labels": []}
+            return {"labels": await batcher.identify(sents)}
+        if not isinstance(request["text"], str):
+            raise TypeError("'text' must be a string")
+        return {"label": (await batcher.identify([request["text"]]))[0]}
+
+
+class FastSpellClient:
+    ''' Blocking client of a FastSpell server, one request at a time '''
+
+    def __init__(self, socket_path=None, host="localhost", port=None, timeout=None):
+        if socket_path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(socket_path)
+        else:
+            self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.stream = self.sock.makefile("rwb")
+        self.request_id = 0
+
+    def request(self, **fields):
+        self.request_id += 1
+        fields["id"] = self.request_id
+        self.stream.write(json.dumps(fields, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the server")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    def getlang(self, sent, lang=None):
+        return self.request(lang=lang, text=sent)["label"]
+
+    def getlangs(self, sents, lang=None):
+        return self.request(lang=lang, texts=list(sents))["labels"]
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_targets(langs, **options):
+    ''' One FastSpell object per target, all of them sharing the FastText model '''
+    targets = {}
+    model = None
+    for lang in langs:
+        if "," in lang:
+            fs = MultiFastSpell(lang.split(","), model=model, **options)
+        else:
+            fs = FastSpell(lang, model=model, **options)
+        model = fs.model
+        targets[lang] = fs
+    return targets
+
+
+async def serve(server, socket_path=None, host="localhost", port=None):
+    await server.start(socket_path, host, port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    address = socket_path or f"{host}:{port}"
+    logging.info(f"Listening on {address}")
+    await stop.wait()
+    logging.info("Stopping")
+    await server.stop()
+    if socket_path is not None and os.path.exists(socket_path):
+        os.remove(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('langs', nargs='+', help="Target languages. Several comma-separated languages (e.g. 'es,gl,ca') are a multi-target, with one label per language")
+    groupA = parser.add_argument_group('Address')
+    groupA.add_argument('-s', '--socket', type=str, default=None, help="Unix socket path to listen on")
+    groupA.add_argument('--host', type=str, default="localhost", help="Host to listen on, if there is no Unix socket")
+    groupA.add_argument('--port', type=int, default=8765, help="TCP port to listen on, if there is no Unix socket")
+
+    parser.add_argument('-c', '--config_path', default=None, type=check_dir, help="Alternative config path. Must contain 'hunspell.yaml' and 'similar.yaml'.")
+    parser.add_argument('--aggr', action='store_true', help='Aggressive strategy (more positives)')
+    parser.add_argument('--cons', action='store_true',  help='Conservative strategy (less positives)')
+    parser.add_argument('--hbs', action='store_true',  help="Tag all Serbo-Croatian variants as 'hbs'")
+    parser.add_argument('--script', action='store_true',  help="Detect writing script (currently only Serbo-Croatian is supported)")
+    parser.add_argument('--skip_model_check', action='store_true', help="Do not verify the integrity of the FastText model")
+    parser.add_argument('--spell_backend', choices=FastSpell.spell_backends, default="hunspell", help="Spellcheck with Hunspell, or with the dictionaries compiled by fastspell-compile when available")
+    parser.add_argument('--sent_cache_size', type=int, default=0, help="Number of identified sentences cached per target (0 to disable)")
+    parser.add_argument('-b', '--batch_size', type=int, default=256, help="Maximum sentences identified together")
+    parser.add_argument('--max_latency', type=float, default=5.0, help="Milliseconds to wait for more sentences before identifying a batch")
+    parser.add_argument('--max_request_size', type=int, default=MAX_REQUEST_SIZE, help="Maximum size in bytes of a request line, longer ones are answered with an error")
+
+    groupL = parser.add_argument_group('Logging')
+    groupL.add_argument('-q', '--quiet', action='store_true', help='Silent logging mode')
+    groupL.add_argument('--debug', action='store_true', help='Debug logging mode')
+    groupL.add_argument('--logfile', type=argparse.FileType('a'), default=sys.stderr, help="Store log to a file")
+    args = parser.parse_args()
+    logging_setup(args)
+
+    if args.aggr == args.cons:
+        logging.error("Please provide  --aggr or --cons")
+        exit(1)
+    if args.batch_size < 1:
+        logging.error("Batch size must be a positive number")
+        exit(1)
+    if args.max_latency < 0:
+        logging.error("Maximum latency must be zero or a positive number")
+        exit(1)
+    if args.max_request_size < 1:
+        logging.error("Maximum request size must be a positive number")
+        exit(1)
+
+    targets = load_targets(args.langs, mode="aggr" if args.aggr else "cons",
+                           config_path=args.config_path, hbs=args.hbs, script=args.script,
+                           verify_model=not args.skip_model_check,
+                           spell_backend=args.spell_backend,
+                           sent_cache_size=args.sent_cache_size,
+                           # Load everything before accepting requests
+                           lazy_dicts=False)
+    server = FastSpellServer(targets, args.batch_size, args.max_latency / 1000, args.max_request_size)
+    asyncio.run(serve(server, args.socket, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,32 @@
-from tempfile import TemporaryDirectory
 from argparse import ArgumentTypeError
+from collections import OrderedDict
+from collections.abc import Mapping
 #from string import punctuation
 import logging
 import hashlib
+import json
+import io
+import gzip
+import lzma
+import queue
+import threading
+import functools
+import importlib.util
 import sys
 import os
 #import unicodedata
-import regex
-
-import fastspell_dictionaries
-import yaml
+# regex, yaml and fastspell_dictionaries are imported on first use,
+# they are slow to import and not needed by every command
 
 
 
 #punct = dict.fromkeys(i for i in range(sys.maxunicode) if unicodedata.category(chr(i)).startswith('P')) #punctuation
-PUNCT_REGEX = regex.compile("(\p{P}+$|^\p{P}+)")
+# Compiled on first use
+PUNCT_REGEX = None
+# All the characters matched by \p{P}, to strip punctuation with str.strip
+# Built on first use, it takes a scan of the whole Unicode range,
+# so it is stored in the cache directory
+PUNCT_CHARS = None
 
 def logging_setup(args = None):
     logger = logging.getLogger()
@@ -39,10 +51,11 @@ def logging_setup(args = None):
 #and focus only on "normal" words.
 #Uppercased (propernouns) rule does not apply to German
 def remove_unwanted_words(tokens, lang):
+    punct_regex = get_punct_regex()
     newtokens = []
     isfirsttoken=True
     for token in tokens:
-        token=PUNCT_REGEX.sub("", token.strip()).strip()  #Regex to remove punctuation
+        token=punct_regex.sub("", token.strip()).strip()  #Regex to remove punctuation
         if lang=="de":
             if any(c.isalpha() for c in token): #token.upper() != token.lower():
                 newtokens.append(token)
@@ -53,20 +66,224 @@ def remove_unwanted_words(tokens, lang):
         isfirsttoken=False
     return newtokens
 
-def get_hash(filepath):
-    hash = None
+def get_punct_regex():
+    global PUNCT_REGEX
+    if PUNCT_REGEX is None:
+        import regex
+        PUNCT_REGEX = regex.compile(r"(\p{P}+$|^\p{P}+)")
+    return PUNCT_REGEX
+
+def get_punct_chars():
+    global PUNCT_CHARS
+    if PUNCT_CHARS is None:
+        # Use the regex module classification, which may follow a different
+        # Unicode version than unicodedata, so tokens are the same as PUNCT_REGEX.
+        # The cached list is valid while the installed regex module is the same.
+        regex_spec = importlib.util.find_spec("regex")
+        signature = {"version": CACHE_VERSION, "regex": stat_signature(regex_spec and regex_spec.origin), "maxunicode": sys.maxunicode}
+        cache_path = cache_file("punct", "regex")
+        PUNCT_CHARS = read_cache(cache_path, signature)
+        if PUNCT_CHARS is None:
+            import regex
+            PUNCT_CHARS = "".join(regex.findall(r"\p{P}", "".join(map(chr, range(sys.maxunicode + 1)))))
+            write_cache(cache_path, signature, PUNCT_CHARS)
+    return PUNCT_CHARS
+
+def tokenize(sent, lang):
+    '''
+    Split a sentence into the tokens to be spellchecked.
+    Same tokens as remove_unwanted_words(sent.strip().split(" "), lang)
+    but punctuation is stripped with str.strip instead of a regex per token.
+    '''
+    punct = get_punct_chars()
+    keep_case = lang == "de"
+    newtokens = []
+    isfirsttoken = True
+    for token in sent.strip().split(" "):
+        token = token.strip().strip(punct).strip()
+        # Most of the tokens are only letters, avoid checking them one by one
+        if token.isalpha() or any(c.isalpha() for c in token):
+            if keep_case:
+                newtokens.append(token)
+            elif isfirsttoken or token[0] == token[0].lower():
+                newtokens.append(token.lower())
+        isfirsttoken = False
+    return newtokens
+
+class BoundedCache:
+    ''' Key-value cache with a maximum size and LRU or FIFO eviction '''
+    policies = ("lru", "fifo")
+
+    def __init__(self, maxsize, policy="lru"):
+        assert maxsize > 0, "Cache size must be a positive number"
+        assert policy in self.policies, f"Unknown eviction policy. Use one of {self.policies}"
+        self.maxsize = maxsize
+        self.policy = policy
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # The cache can be shared by several threads
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            if self.policy == "lru":
+                self.data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "maxsize": self.maxsize, "currsize": len(self.data)}
+
+
+def add_counters(total, counters):
+    ''' Add (nested dictionaries of) numeric counters to total '''
+    for key, value in counters.items():
+        if isinstance(value, dict):
+            add_counters(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)):
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def get_hash(filepath, chunk_size=1<<20):
+    ''' MD5 of a file, read in chunks to avoid loading it whole in memory '''
     try:
+        md5Hash = hashlib.md5()
         with open(filepath, 'rb') as model_file:
-            file_content = model_file.read()
-            md5Hash = hashlib.md5(file_content)
-            hash = md5Hash.hexdigest()
-        return hash    
+            for chunk in iter(lambda: model_file.read(chunk_size), b""):
+                md5Hash.update(chunk)
+        return md5Hash.hexdigest()
     except FileNotFoundError:
         return None
 
 
-def load_config(config_path=None):
-    ''' Load FastSpell yaml config files: similar langs and hunspell dicts '''
+#Sidecar file that records the hash of an already verified file
+#keyed on its path, size, mtime and inode.
+#If any of them changes, the file has to be verified again.
+def hash_stamp_path(filepath):
+    return filepath + ".verified"
+
+def file_signature(filepath):
+    st = os.stat(filepath)
+    return {"path": os.path.abspath(filepath),
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "inode": st.st_ino}
+
+def read_hash_stamp(filepath):
+    ''' Return the verified hash of a file if it has not changed since it was recorded '''
+    try:
+        with open(hash_stamp_path(filepath)) as stamp_file:
+            stamp = json.load(stamp_file)
+        if stamp["file"] == file_signature(filepath):
+            return stamp["hash"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def write_hash_stamp(filepath, hash):
+    ''' Record the verified hash of a file, ignoring failures (e.g. read-only installs) '''
+    stamp_path = hash_stamp_path(filepath)
+    try:
+        stamp = {"file": file_signature(filepath), "hash": hash}
+        with open(stamp_path + ".tmp", 'w') as stamp_file:
+            json.dump(stamp, stamp_file)
+        os.replace(stamp_path + ".tmp", stamp_path)
+    except OSError as ex:
+        logging.debug(f"Could not write verification stamp {stamp_path}: {ex}")
+
+
+#Cache of parsed config files, resolved dictionary paths and the punctuation
+#characters, so short runs do not pay for them every time.
+#Each cache file records the signature of what it was built from
+#(e.g. mtime and size of a yaml file) and is rebuilt when it changes.
+CACHE_VERSION = 1
+
+def cache_dir():
+    ''' Cache directory: $FASTSPELL_CACHE_DIR, $XDG_CACHE_HOME/fastspell or ~/.cache/fastspell. None if $FASTSPELL_CACHE_DIR is empty '''
+    if "FASTSPELL_CACHE_DIR" in os.environ:
+        return os.environ["FASTSPELL_CACHE_DIR"] or None
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "fastspell")
+
+def cache_file(kind, key):
+    directory = cache_dir()
+    if directory is None:
+        return None
+    return os.path.join(directory, f"{kind}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.json")
+
+def stat_signature(path):
+    ''' mtime and size of a file or directory, None if it does not exist '''
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+def read_cache(cache_path, signature):
+    ''' Return the value of a cache file if it was built from the same signature '''
+    if cache_path is None:
+        return None
+    try:
+        with open(cache_path) as cache:
+            cached = json.load(cache)
+        if cached["signature"] == signature:
+            return cached["value"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def write_cache(cache_path, signature, value):
+    ''' Store a value in a cache file, ignoring failures (e.g. read-only home) '''
+    if cache_path is None:
+        return
+    cached = {"signature": signature, "value": value}
+    try:
+        data = json.dumps(cached)
+        if json.loads(data) != cached:
+            # Not representable in JSON, e.g. non-string keys
+            return
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # One temporary file per process, several may write at once
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as cache:
+            cache.write(data)
+        os.replace(temp_path, cache_path)
+    except (OSError, ValueError, TypeError) as ex:
+        logging.debug(f"Could not write cache file {cache_path}: {ex}")
+
+def load_yaml(path):
+    ''' Parse a yaml file, or take it from the cache if the file has not changed '''
+    path = os.path.realpath(path)
+    signature = {"version": CACHE_VERSION, "file": stat_signature(path)}
+    cache_path = cache_file("yaml", path)
+    value = read_cache(cache_path, signature)
+    if value is None:
+        import yaml
+        with open(path) as yaml_file:
+            value = yaml.safe_load(yaml_file)
+        write_cache(cache_path, signature, value)
+    return value
+
+
+def default_config_path():
+    return os.path.dirname(__file__) + "/config"
+
+
+def resolve_config_path(config_path=None):
+    ''' Config directory to use: the given one, $FASTSPELL_CONFIG or the default '''
     if not config_path and "FASTSPELL_CONFIG" in os.environ:
         config_path = os.environ["FASTSPELL_CONFIG"]
         if not os.path.isdir(config_path):
@@ -74,16 +291,19 @@ def load_config(config_path=None):
             config_path = None
 
     if not config_path:
-        cur_path = os.path.dirname(__file__)
-        config_path = cur_path + "/config"
+        config_path = default_config_path()
+    return config_path
+
+
+def load_config(config_path=None):
+    ''' Load FastSpell yaml config files: similar langs and hunspell dicts. Parsed files are cached, see load_yaml '''
+    config_path = resolve_config_path(config_path)
 
     #similar languages
-    with open(config_path+"/similar.yaml") as similar_yaml_file:
-        similar_langs = yaml.safe_load(similar_yaml_file)["similar"]
+    similar_langs = load_yaml(config_path+"/similar.yaml")["similar"]
 
     #hunspell
-    with open(config_path+"/hunspell.yaml") as hunspell_codes_file:
-        hunspell_config = yaml.safe_load(hunspell_codes_file)
+    hunspell_config = load_yaml(config_path+"/hunspell.yaml")
     hunspell_codes = hunspell_config["hunspell_codes"]
     if hunspell_config["dictpath"]:
         # If config has a hunspell path, add it
@@ -99,6 +319,7 @@ def load_config(config_path=None):
     # Firstly use hunspell path from config if there is
     # secondly try local/share/hunspell (which is the default download)
     # finally add all the remainin hunspell paths
+    import fastspell_dictionaries
     hunspell_paths.append(fastspell_dictionaries.__path__[0])
     if "HOME" in os.environ:
         hunspell_paths.append(os.path.expanduser("~/.local/share/fastspell"))
@@ -114,6 +335,380 @@ def load_config(config_path=None):
     return similar_langs, hunspell_codes, hunspell_paths
 
 
+def similar_lists(lang, similar_langs):
+    ''' Lists of similar languages spellchecked for a target, one per script, each one ending with the target '''
+    similar = []
+    for sim_entry in similar_langs:
+        if sim_entry.split('_')[0] == lang:
+            similar.append(similar_langs[sim_entry] + [sim_entry])
+    return similar
+
+
+# Dictionaries found in each list of search paths, see hunspell_dict_index
+hunspell_indexes = {}
+hunspell_indexes_lock = threading.Lock()
+
+def hunspell_dict_index(hunspell_paths):
+    '''
+    Dictionary codes with .dic and .aff files in the search paths, mapped to the first path that has them.
+    Listing the directories replaces two existence checks per path and dictionary.
+    The index is kept until any of the directories changes, in this process and in the cache directory.
+    '''
+    signature = {"version": CACHE_VERSION, "dirs": [[p, stat_signature(p)] for p in hunspell_paths]}
+    key = "\n".join(hunspell_paths)
+    with hunspell_indexes_lock:
+        cached = hunspell_indexes.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        cache_path = cache_file("dicts", key)
+        index = read_cache(cache_path, signature)
+        if index is None:
+            index = {}
+            for p, dir_signature in signature["dirs"]:
+                if dir_signature is None:
+                    continue
+                try:
+                    files = set(os.listdir(p))
+                except OSError:
+                    continue
+                for name in files:
+                    code, ext = os.path.splitext(name)
+                    if ext == ".dic" and code + ".aff" in files and code not in index:
+                        index[code] = p
+            write_cache(cache_path, signature, index)
+        hunspell_indexes[key] = (signature, index)
+        return index
+
+
+def search_hunspell_dict(lang_code, hunspell_paths):
+    ''' Search in the paths for a hunspell dictionary and return its path (without extension) '''
+    index = hunspell_dict_index(hunspell_paths)
+    if lang_code in index:
+        return index[lang_code] + '/' + lang_code
+    # Not a plain file in the listings (e.g. a code with a subdirectory), look for it as before
+    for p in hunspell_paths:
+        if os.path.exists(f"{p}/{lang_code}.dic") and os.path.exists(f"{p}/{lang_code}.aff"):
+            return p + '/' + lang_code
+    raise RuntimeError(f"It does not exist any valid dictionary directory"
+                       f"for {lang_code} in the paths {hunspell_paths}."
+                       f"Please, execute 'fastspell-download'.")
+
+
+class ScriptTable:
+    '''
+    Script detection for the variants of a language.
+    Each character is classified with a lookup table indexed by code point
+    that maps it to the bitmask of the scripts it belongs to,
+    so all the scripts are counted with a single pass over the sentence.
+    '''
+
+    def __init__(self, lang, scripts):
+        if not 0 < len(scripts) <= 8:
+            raise ValueError(f"Script detection for '{lang}' needs between 1 and 8 scripts")
+        self.labels = [f"{lang}_{script}" for script in scripts]
+
+        # The table covers at least the first 256 code points, where bitmasks are
+        size = max(256, max(ord(c) for chars in scripts.values() for c in chars) + 1)
+        masks = [0] * size
+        for i, chars in enumerate(scripts.values()):
+            for c in chars:
+                masks[ord(c)] |= 1 << i
+        # Characters are replaced by their bitmask and the ones in no script are removed.
+        # Code points above the table are left as they are, they can't be taken
+        # for a bitmask because those are inside the table.
+        self.table = tuple(chr(mask) if mask else None for mask in masks)
+        # Scripts that each of the bitmasks counts for
+        self.masks = tuple((chr(mask), tuple(i for i in range(len(scripts)) if mask >> i & 1))
+                           for mask in sorted(set(masks)) if mask)
+
+    def detect(self, sent):
+        ''' Label of the script with more characters in the sentence, the first one on ties '''
+        classified = sent.translate(self.table)
+        counts = [0] * len(self.labels)
+        for mask, scripts in self.masks:
+            n = classified.count(mask)
+            if n:
+                for i in scripts:
+                    counts[i] += n
+        return self.labels[counts.index(max(counts))]
+
+
+class ScriptTables(Mapping):
+    ''' Script tables of each language, built the first time they are used '''
+    def __init__(self, scripts):
+        for lang, lang_scripts in scripts.items():
+            if not 0 < len(lang_scripts) <= 8:
+                raise ValueError(f"Script detection for '{lang}' needs between 1 and 8 scripts")
+        self.scripts = scripts
+        self.tables = {}
+
+    def __getitem__(self, lang):
+        table = self.tables.get(lang)
+        if table is None:
+            # Built twice at worst if two threads get here at once, with the same result
+            table = self.tables[lang] = ScriptTable(lang, self.scripts[lang])
+        return table
+
+    def __contains__(self, lang):
+        return lang in self.scripts
+
+    def __iter__(self):
+        return iter(self.scripts)
+
+    def __len__(self):
+        return len(self.scripts)
+
+
+@functools.lru_cache(maxsize=None)
+def load_script_file(path):
+    return ScriptTables(load_yaml(path)["scripts"])
+
+
+def load_script_tables(config_path=None):
+    '''
+    Script tables of the languages written in several scripts, from scripts.yaml
+    Falls back to the default file if the config directory has none.
+    Tables are built once per file, on first use, and shared by all FastSpell instances.
+    '''
+    path = os.path.join(resolve_config_path(config_path), "scripts.yaml")
+    if not os.path.exists(path):
+        path = os.path.join(default_config_path(), "scripts.yaml")
+    return load_script_file(os.path.realpath(path))
+
+
+# Magic bytes and extensions of supported compression formats
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"\xfd\x37\x7a\x58\x5a\x00": "xz",
+}
+COMPRESSION_EXTENSIONS = {
+    ".gz": "gzip",
+    ".zst": "zstd",
+    ".zstd": "zstd",
+    ".xz": "xz",
+}
+
+def compression_from_path(path):
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+def compression_from_magic(stream):
+    ''' Detect compression from the first bytes of a buffered stream without consuming them '''
+    head = stream.peek(6)[:6]
+    for magic, compression in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("Reading or writing zstd files requires the 'zstandard' package."
+                           " Please, install it with 'pip install zstandard'.")
+    return zstandard
+
+
+class ThreadedReader(io.RawIOBase):
+    ''' Read a stream in a background thread, so that reading and decompressing overlaps with processing '''
+    def __init__(self, stream, block_size=1<<20, max_blocks=16):
+        self.stream = stream
+        self.block_size = block_size
+        self.blocks = queue.Queue(max_blocks)
+        self.pending = memoryview(b"")
+        self.eof = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while True:
+                block = self.stream.read(self.block_size)
+                self.blocks.put(block)
+                if not block:
+                    break
+        except Exception as ex:
+            self.blocks.put(ex)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.pending:
+            if self.eof:
+                return 0
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self.eof = True
+                return 0
+            self.pending = memoryview(block)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+        super().close()
+
+
+class ThreadedWriter(io.RawIOBase):
+    ''' Write to a stream in a background thread, so that compressing and writing overlaps with processing '''
+    def __init__(self, stream, max_blocks=16):
+        self.stream = stream
+        self.blocks = queue.Queue(max_blocks)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            block = self.blocks.get()
+            try:
+                if block is None:
+                    break
+                if self.error is None:
+                    self.stream.write(block)
+            except Exception as ex:
+                self.error = ex
+            finally:
+                self.blocks.task_done()
+
+    def check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.check_error()
+        self.blocks.put(bytes(data))
+        return len(data)
+
+    def flush(self):
+        # Wait until everything queued has been written
+        if not self.closed:
+            self.blocks.join()
+            self.check_error()
+            self.stream.flush()
+
+    def close(self):
+        if not self.closed:
+            super().close() # flushes what is still queued
+            self.blocks.put(None)
+            self.thread.join()
+            self.stream.close()
+            self.check_error()
+
+
+def open_input(path, buffer_size=1<<20):
+    '''
+    Open an input file (or stdin if path is '-') for binary reading with a large buffer.
+    Gzip, zstd and xz files are detected by extension or magic bytes
+    and decompressed in a background thread.
+    '''
+    if path == '-':
+        raw = io.FileIO(sys.stdin.fileno(), 'rb', closefd=False)
+    else:
+        raw = io.FileIO(path, 'rb')
+    stream = io.BufferedReader(raw, buffer_size)
+
+    compression = compression_from_magic(stream) or (path != '-' and compression_from_path(path))
+    if not compression:
+        return stream
+    logging.debug(f"Reading {compression} compressed input")
+    if compression == "gzip":
+        decompressed = gzip.GzipFile(fileobj=stream, mode='rb')
+    elif compression == "xz":
+        decompressed = lzma.LZMAFile(stream, mode='rb')
+    else:
+        decompressed = import_zstandard().ZstdDecompressor().stream_reader(stream, read_across_frames=True, closefd=True)
+    return io.BufferedReader(ThreadedReader(decompressed, buffer_size), buffer_size)
+
+def open_output(path, buffer_size=1<<20):
+    '''
+    Open an output file (or stdout if path is '-') for binary writing with a large buffer.
+    Files with .gz, .zst or .xz extension are compressed in a background thread.
+    '''
+    if path == '-':
+        sys.stdout.flush()
+        return io.BufferedWriter(io.FileIO(sys.stdout.fileno(), 'wb', closefd=False), buffer_size)
+
+    compression = compression_from_path(path)
+    if not compression:
+        return open(path, 'wb', buffering=buffer_size)
+    logging.debug(f"Writing {compression} compressed output")
+    if compression == "gzip":
+        compressed = gzip.open(path, 'wb', compresslevel=6)
+    elif compression == "xz":
+        compressed = lzma.open(path, 'wb')
+    else:
+        raw = open(path, 'wb')
+        compressed = import_zstandard().ZstdCompressor().stream_writer(raw, closefd=True)
+    return io.BufferedWriter(ThreadedWriter(compressed), buffer_size)
+
+
+def is_compressed(path):
+    with open(path, 'rb') as stream:
+        return compression_from_magic(io.BufferedReader(stream)) is not None or bool(compression_from_path(path))
+
+
+def parse_shard(value):
+    ''' Parse a shard specification 'i/N' (from 1/N to N/N) '''
+    try:
+        index, total = (int(n) for n in value.split('/'))
+    except ValueError:
+        raise ArgumentTypeError(f"'{value}' is not a shard, use 'i/N' (e.g. 3/8)")
+    if total < 1 or not 1 <= index <= total:
+        raise ArgumentTypeError(f"Shard index must be between 1 and {max(total, 1)}")
+    return index, total
+
+def shard_range(size, index, total):
+    ''' Byte range of a shard of a file, before snapping to line boundaries '''
+    return size * (index-1) // total, size * index // total
+
+def seek_line(stream, offset):
+    ''' Move a seekable binary stream to the first line that starts at or after offset, and return its position '''
+    if offset <= 0:
+        stream.seek(0)
+        return 0
+    # Skip the rest of the line containing the previous byte, which is empty if it is a newline
+    stream.seek(offset - 1)
+    stream.readline()
+    return stream.tell()
+
+def read_lines_until(stream, position, end=None):
+    ''' Lines of a stream, starting at position, until the first one that starts at or after end '''
+    while end is None or position < end:
+        line = stream.readline()
+        if not line:
+            break
+        position += len(line)
+        yield line
+
+
+def read_checkpoint(path):
+    ''' Return the contents of a checkpoint file, or None if it does not exist '''
+    try:
+        with open(path) as checkpoint_file:
+            return json.load(checkpoint_file)
+    except FileNotFoundError:
+        return None
+
+def write_checkpoint(path, checkpoint):
+    ''' Replace a checkpoint file atomically, so it is never left half written '''
+    with open(path + ".tmp", 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(path + ".tmp", path)
+
+
 def check_dir(path):
     if not os.path.exists(path):
         raise ArgumentTypeError(f"{path} does not exist")
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+'''
+Compressed I/O benchmark.
+Compares the throughput of the fastspell CLI reading and writing gzip files
+directly against the equivalent shell pipeline with zcat and gzip.
+'''
+import subprocess
+import argparse
+import tempfile
+import shlex
+import json
+import gzip
+import sys
+import os
+import timeit
+
+SENTENCES = [
+    "El gato está durmiendo en la mesa de la cocina desde esta mañana.",
+    "Bos días, como estás? Hoxe vai moito frío na rúa.",
+    "Bon dia a tothom, avui fa un temps esplèndid per passejar.",
+    "Hello, world",
+    "Política de privacidad | Aviso legal | Cookies",
+]
+
+
+def run_command(command):
+    start = timeit.default_timer()
+    subprocess.run(command, shell=True, check=True)
+    return timeit.default_timer() - start
+
+
+def run(lang="es", lines=200000):
+    fastspell = f"{shlex.quote(sys.executable)} -m fastspell.fastspell --cons -q {lang}"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpus = os.path.join(tmpdir, "corpus.gz")
+        output = os.path.join(tmpdir, "output.gz")
+        with gzip.open(corpus, 'wt') as corpus_file:
+            for i in range(lines):
+                corpus_file.write(f"{SENTENCES[i % len(SENTENCES)]} {i}\n")
+
+        pipe = run_command(f"zcat {corpus} | {fastspell} | gzip > {output}")
+        direct = run_command(f"{fastspell} {corpus} {output}")
+
+    return {
+        "lang": lang,
+        "lines": lines,
+        "shell_pipe_lines_per_sec": lines / pipe,
+        "compressed_io_lines_per_sec": lines / direct,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-l', '--lang', default='es', help="Target language")
+    parser.add_argument('-n', '--lines', type=int, default=200000, help="Number of lines of the synthetic corpus")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.lang, args.lines), indent=2))
+
+
+if __name__ == '__main__':
+    main()
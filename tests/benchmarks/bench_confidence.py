@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''
+Confidence-gated refinement benchmark.
+Measures lines per second of each target language over its fixture corpus
+when Hunspell refinement is skipped above increasing FastText probabilities
+(skip_confidence), the fraction of sentences skipped and the labels that
+change with respect to always refining.
+See eval_confidence.py for the accuracy over a labeled fixture.
+'''
+import argparse
+import json
+import timeit
+
+from fastspell import FastSpell
+from common import CORPORA, load_corpus
+
+THRESHOLDS = (0.0, 0.5, 0.8, 0.9, 0.95, 0.99)
+
+
+def run(targets=tuple(CORPORA), lines=10000, thresholds=THRESHOLDS, min_words=0, batch_size=1000):
+    results = []
+    for target in targets:
+        sents = load_corpus(CORPORA[target], lines)
+        reference = None
+        for threshold in thresholds:
+            # Spellchecking cache disabled, so skipped sentences are not hidden by cache hits
+            fs = FastSpell(target, mode="cons", spell_cache_size=0, lazy_dicts=False, stats=True,
+                           skip_confidence=threshold, skip_min_words=min_words)
+            fs.getlangs(load_corpus(CORPORA[target]))
+            fs.reset_stats()
+
+            start = timeit.default_timer()
+            labels = []
+            for i in range(0, len(sents), batch_size):
+                labels.extend(fs.getlangs(sents[i:i+batch_size]))
+            elapsed = timeit.default_timer() - start
+            if reference is None:
+                reference = labels
+
+            stats = fs.get_stats()
+            results.append({
+                "lang": target,
+                "skip_confidence": threshold,
+                "skip_min_words": min_words,
+                "lines": len(sents),
+                "lines_per_sec": len(sents) / elapsed,
+                "refined": stats["refined"] / len(sents),
+                "skipped": stats["decisions"].get("confident", 0) / len(sents),
+                "changed_labels": sum(a != b for a, b in zip(labels, reference)) / len(sents),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-t', '--targets', default=",".join(CORPORA), help="Comma-separated target languages")
+    parser.add_argument('-n', '--lines', type=int, default=10000, help="Lines identified per target")
+    parser.add_argument('-s', '--thresholds', default=",".join(map(str, THRESHOLDS)), help="Comma-separated skip_confidence values")
+    parser.add_argument('-w', '--min_words', type=int, default=0, help="skip_min_words for all the measures")
+    args = parser.parse_args()
+
+    thresholds = [float(t) for t in args.thresholds.split(',')]
+    print(json.dumps(run(args.targets.split(','), args.lines, thresholds, args.min_words), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+'''
+Early-exit scoring benchmark.
+Measures the refinement cost per sentence on long sentences (several fixture
+lines joined) with full scoring, with early exit and with token caps,
+and how many labels change against full scoring.
+'''
+import argparse
+import json
+import timeit
+
+from fastspell import FastSpell
+from common import CORPORA, load_corpus
+
+TARGETS = ["es", "hbs", "nb", "is"]
+
+CONFIGS = {
+    "full": {},
+    "early_exit": {"early_exit": True},
+    "max_tokens_50": {"early_exit": True, "max_tokens": 50},
+    "max_tokens_20": {"early_exit": True, "max_tokens": 20},
+}
+
+
+def run(lines=1000, join=10, targets=TARGETS):
+    results = []
+    for target in targets:
+        corpus = load_corpus(CORPORA[target], lines * join)
+        sents = [" ".join(corpus[i:i+join]) for i in range(0, len(corpus), join)]
+        # Force the refinement path by refining as if FastText predicted the target
+        prediction = "sr" if target == "hbs" else target
+
+        reference = None
+        result = {"lang": target, "sentences": len(sents), "configs": {}}
+        for name, options in CONFIGS.items():
+            # No spellchecking cache, to measure Hunspell work,
+            # and dictionaries loaded beforehand
+            fs = FastSpell(target, mode="cons", spell_cache_size=0, lazy_dicts=False,
+                           stats=True, **options)
+            # Warm up lazily built tables
+            fs.refine(sents[0], prediction)
+            fs.reset_stats()
+            start = timeit.default_timer()
+            labels = [fs.refine(sent, prediction) for sent in sents]
+            elapsed = timeit.default_timer() - start
+            if reference is None:
+                reference = labels
+            result["configs"][name] = {
+                "usec_per_sentence": 1e6 * elapsed / len(sents),
+                "spellchecked_tokens": sum(fs.get_stats()["spellchecked_tokens"].values()),
+                "changed_labels": sum(a != b for a, b in zip(labels, reference)),
+            }
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--lines', type=int, default=1000, help="Long sentences per target language")
+    parser.add_argument('-j', '--join', type=int, default=10, help="Fixture lines joined in each long sentence")
+    parser.add_argument('-t', '--targets', default=",".join(TARGETS), help="Comma-separated target languages")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.lines, args.join, args.targets.split(',')), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+'''
+Import and startup benchmark.
+Measures, each one in a fresh process, the time to import fastspell
+(and which of the slow dependencies it loads), the wall time of
+'fastspell --help' against an empty interpreter, and the time to load the
+config, resolve the dictionaries, construct a FastSpell object and tokenize
+the first sentence with a cold config cache (empty cache directory) and a
+warm one (see FASTSPELL_CACHE_DIR).
+'''
+from tempfile import TemporaryDirectory
+import subprocess
+import argparse
+import json
+import sys
+import os
+import timeit
+
+HEAVY_MODULES = ("fasttext", "hunspell", "hanzidentifier", "regex", "yaml",
+                 "fastspell_dictionaries", "numpy", "multiprocessing", "urllib.request", "importlib.metadata")
+TARGETS = ["en", "es", "hbs"]
+
+
+def child_import():
+    start = timeit.default_timer()
+    import fastspell
+    elapsed = timeit.default_timer() - start
+    print(json.dumps({
+        "import": elapsed,
+        "loaded": [module for module in HEAVY_MODULES if module in sys.modules],
+    }))
+
+
+def child_construct(lang):
+    start = timeit.default_timer()
+    from fastspell import FastSpell
+    from fastspell.util import load_config, load_script_tables, search_hunspell_dict, similar_lists, tokenize
+    imported = timeit.default_timer()
+
+    similar_langs, hunspell_codes, hunspell_paths = load_config()
+    load_script_tables()
+    for similar in similar_lists(lang, similar_langs):
+        for l in similar:
+            search_hunspell_dict(hunspell_codes[l], hunspell_paths)
+    config = timeit.default_timer()
+
+    FastSpell(lang)
+    constructed = timeit.default_timer()
+    tokenize("Hello, world!", lang)
+    tokenized = timeit.default_timer()
+    print(json.dumps({
+        "import": imported - start,
+        "config": config - imported,
+        "construction": constructed - config,
+        "first_tokenize": tokenized - constructed,
+    }))
+
+
+def run_child(args, env=None, repeat=1):
+    ''' Run this script in a fresh process and return the best of each measure '''
+    best = {}
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__)] + args,
+                                check=True, capture_output=True, text=True, env=env).stdout
+        for key, value in json.loads(output).items():
+            if isinstance(value, float):
+                best[key] = min(value, best.get(key, value))
+            else:
+                best[key] = value
+    return best
+
+
+def wall_time(cmd, repeat):
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+        times.append(timeit.default_timer() - start)
+    return min(times)
+
+
+def run(targets=TARGETS, repeat=5):
+    results = {
+        "import": run_child(["--child", "import"], repeat=repeat),
+        "python": wall_time([sys.executable, "-c", "pass"], repeat),
+        "help": wall_time([sys.executable, "-c", "from fastspell.fastspell import main; main()", "--help"], repeat),
+        "targets": [],
+    }
+    for lang in targets:
+        cold = {}
+        for _ in range(repeat):
+            with TemporaryDirectory() as cache_dir:
+                env = dict(os.environ, FASTSPELL_CACHE_DIR=cache_dir)
+                for key, value in run_child(["--child", "construct", "--lang", lang], env).items():
+                    cold[key] = min(value, cold.get(key, value))
+        with TemporaryDirectory() as cache_dir:
+            env = dict(os.environ, FASTSPELL_CACHE_DIR=cache_dir)
+            run_child(["--child", "construct", "--lang", lang], env)
+            warm = run_child(["--child", "construct", "--lang", lang], env, repeat)
+        results["targets"].append({"lang": lang, "cold_cache": cold, "warm_cache": warm})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-t', '--targets', default=",".join(TARGETS), help="Comma-separated target languages")
+    parser.add_argument('-r', '--repeat', type=int, default=5, help="Repetitions, the best one is reported")
+    parser.add_argument('--child', choices=("import", "construct"), help=argparse.SUPPRESS)
+    parser.add_argument('--lang', default="en", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == "import":
+        child_import()
+    elif args.child == "construct":
+        child_construct(args.lang)
+    else:
+        print(json.dumps(run(args.targets.split(','), args.repeat), indent=2))
+
+
+if __name__ == '__main__':
+    main()
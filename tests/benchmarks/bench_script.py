@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+'''
+Script detection micro-benchmark.
+Measures the per-sentence cost of script detection for Serbo-Croatian
+with the code point lookup tables, against the previous approach
+of one translate table per script.
+'''
+import argparse
+import json
+import timeit
+import sys
+
+from fastspell.util import load_script_tables
+from common import load_corpus
+
+
+def translate_tables(script_table):
+    ''' Previous implementation: a translate table deleting the characters of each script '''
+    tables = {}
+    for i, label in enumerate(script_table.labels):
+        chars = "".join(chr(cp) for cp, mask in enumerate(script_table.table)
+                        if mask is not None and ord(mask) >> i & 1)
+        tables[label] = str.maketrans('', '', chars)
+    return tables
+
+
+def getscript_translate(sent, tables):
+    best_count = sys.maxsize
+    best_script = None
+    for script, table in tables.items():
+        count_chars = len(sent.translate(table))
+        if count_chars < best_count:
+            best_count = count_chars
+            best_script = script
+    return best_script
+
+
+def run(lines=20000, lang="hbs"):
+    script_table = load_script_tables()[lang]
+    tables = translate_tables(script_table)
+    sents = load_corpus("hbs", lines)
+
+    start = timeit.default_timer()
+    detected = [script_table.detect(sent) for sent in sents]
+    lookup = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    reference = [getscript_translate(sent, tables) for sent in sents]
+    translate = timeit.default_timer() - start
+
+    return {
+        "lang": lang,
+        "sentences": len(sents),
+        "same_output": detected == reference,
+        "usec_per_sentence": {
+            "lookup_table": 1e6 * lookup / len(sents),
+            "translate_tables": 1e6 * translate / len(sents),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--lines', type=int, default=20000, help="Sentences to detect")
+    parser.add_argument('-l', '--lang', default="hbs", help="Language of the script tables")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.lines, args.lang), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+'''
+Refinement micro-benchmark.
+Measures the per-sentence cost of the Hunspell refinement stage
+against the number of similar languages of the target.
+'''
+import argparse
+import json
+import timeit
+
+from fastspell import FastSpell
+
+SENTENCES = [
+    "El gato está durmiendo en la mesa de la cocina desde esta mañana.",
+    "Bos días, como estás? Hoxe vai moito frío na rúa.",
+    "Bon dia a tothom, avui fa un temps esplèndid per passejar.",
+    "Ég fór í bíó með vinum mínum í gærkvöldi og það var gaman.",
+    "Hello, world",
+]
+
+# Targets with an increasing number of similar languages
+TARGETS = ["en", "ast", "gl", "es", "is"]
+
+
+def run(number=2000, spell_cache_size=0):
+    results = []
+    for target in TARGETS:
+        fs = FastSpell(target, mode="cons", spell_cache_size=spell_cache_size)
+        num_similar = max((len(sim_list) for sim_list in fs.similar), default=0)
+        sents = [SENTENCES[i % len(SENTENCES)] for i in range(number)]
+
+        # Force the refinement path by refining as if FastText predicted the target
+        start = timeit.default_timer()
+        for sent in sents:
+            fs.refine(sent, target)
+        elapsed = timeit.default_timer() - start
+
+        results.append({
+            "lang": target,
+            "similar_langs": num_similar,
+            "usec_per_sentence": 1e6 * elapsed / len(sents),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--number', type=int, default=2000, help="Sentences refined per target")
+    parser.add_argument('--spell_cache_size', type=int, default=0, help="Spell cache size (disabled by default to measure Hunspell)")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.number, args.spell_cache_size), indent=2))
+
+
+if __name__ == '__main__':
+    main()
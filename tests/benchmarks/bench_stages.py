@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+'''
+Per-stage benchmark.
+Identifies the fixture corpus of each target language line by line
+and reports the time spent in each stage: FastText prediction,
+script detection, tokenization, Hunspell spellchecking and Chinese script (zh) handling,
+as collected by FastSpell stats.
+'''
+import argparse
+import json
+import timeit
+
+from fastspell import FastSpell
+from common import CORPORA, load_corpus
+
+
+def run_target(target, lines):
+    sents = load_corpus(CORPORA[target], lines)
+    # Spellchecking cache disabled to measure Hunspell itself
+    fs = FastSpell(target, mode="cons", spell_cache_size=0, lazy_dicts=False, stats=True)
+
+    start = timeit.default_timer()
+    for sent in sents:
+        fs.getlang(sent)
+    total = timeit.default_timer() - start
+
+    stats = fs.get_stats()
+    result = {"lang": target, "lines": len(sents), "refined": stats["refined"], "total": total}
+    result.update(stats["time"])
+    result["other"] = total - sum(stats["time"].values())
+    return result
+
+
+def run(targets=tuple(CORPORA), lines=5000):
+    return [run_target(target, lines) for target in targets]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-t', '--targets', default=",".join(CORPORA), help="Comma-separated target languages")
+    parser.add_argument('-n', '--lines', type=int, default=5000, help="Lines identified per target")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.targets.split(','), args.lines), indent=2))
+
+
+if __name__ == '__main__':
+    main()
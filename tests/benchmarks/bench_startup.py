@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+'''
+FastSpell startup benchmark.
+Measures construction time with a cold model verification cache
+(full MD5 of the FastText model), with a warm cache (sidecar stamp)
+and with verification disabled.
+Also measures construction time and memory (RSS) of each target language
+with lazy and eager loading of Hunspell dictionaries,
+and eager loading of compiled dictionaries (see fastspell-compile),
+each one in a fresh process.
+'''
+import subprocess
+import argparse
+import resource
+import json
+import sys
+import os
+import timeit
+
+from fastspell import FastSpell
+from fastspell.util import hash_stamp_path
+
+TARGETS = ["en", "es", "hbs", "nb", "is"]
+
+
+def time_construction(lang, repeat, **kwargs):
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        FastSpell(lang, **kwargs)
+        times.append(timeit.default_timer() - start)
+    return min(times)
+
+
+def measure_child(lang, lazy, backend):
+    ''' Construct one FastSpell object in this process and report time and peak RSS '''
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = timeit.default_timer()
+    fs = FastSpell(lang, lazy_dicts=lazy, spell_backend=backend)
+    elapsed = timeit.default_timer() - start
+    print(json.dumps({
+        "lang": lang,
+        "lazy_dicts": lazy,
+        "spell_backend": backend,
+        "construction": elapsed,
+        "rss_kb_before": rss_before,
+        "rss_kb_after": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }))
+
+
+def measure_targets(targets):
+    results = []
+    for lang in targets:
+        for lazy, backend in ((False, "hunspell"), (True, "hunspell"), (False, "compiled")):
+            cmd = [sys.executable, os.path.abspath(__file__), "--child", lang, "--backend", backend]
+            if lazy:
+                cmd.append("--lazy")
+            output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output))
+    return results
+
+
+def run(lang="en", targets=TARGETS, repeat=3):
+    # Make sure the model is downloaded before measuring
+    fs = FastSpell(lang)
+    stamp = hash_stamp_path(os.path.join(fs.cur_path, "lid.176.bin"))
+
+    cold = []
+    for _ in range(repeat):
+        if os.path.exists(stamp):
+            os.remove(stamp)
+        cold.append(time_construction(lang, 1))
+
+    results = {
+        "lang": lang,
+        "cold_verification": min(cold),
+        "warm_verification": time_construction(lang, repeat),
+        "no_verification": time_construction(lang, repeat, verify_model=False),
+        # Cold: fresh process, warm: model and dictionaries already loaded in this process
+        "targets": measure_targets(targets),
+        "warm_construction": {target: time_construction(target, repeat, lazy_dicts=False)
+                              for target in targets},
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-l', '--lang', default='en', help="Target language for the verification measures")
+    parser.add_argument('-t', '--targets', default=",".join(TARGETS), help="Comma-separated targets for the construction measures")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="Repetitions, the best one is reported")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--lazy', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--backend', default="hunspell", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure_child(args.child, args.lazy, args.backend)
+        return
+
+    print(json.dumps(run(args.lang, args.targets.split(','), args.repeat), indent=2))
+
+
+if __name__ == '__main__':
+    main()
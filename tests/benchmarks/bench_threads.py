@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+'''
+Thread pool benchmark.
+Measures lines per second of each target language over its fixture corpus
+with getlangs_threaded and an increasing number of threads sharing one
+FastSpell instance, against a single getlangs call per chunk.
+Hunspell holds the GIL while spellchecking, so no speedup is expected,
+this checks that sharing the instance does not make it slower.
+'''
+import argparse
+import json
+import os
+import timeit
+
+from fastspell import FastSpell
+from common import CORPORA, load_corpus
+
+THREADS = (1, 2, 4, 8)
+
+
+def lines_per_sec(function, sents):
+    start = timeit.default_timer()
+    function(sents)
+    return len(sents) / (timeit.default_timer() - start)
+
+
+def run(targets=tuple(CORPORA), lines=10000, threads=THREADS, chunk_size=250):
+    results = []
+    for target in targets:
+        sents = load_corpus(CORPORA[target], lines)
+        # Caches disabled, so every thread does the same work on every run
+        fs = FastSpell(target, mode="cons", spell_cache_size=0, lazy_dicts=False)
+        fs.getlangs(load_corpus(CORPORA[target]))
+        serial = lines_per_sec(lambda s: [fs.getlangs(s[i:i+chunk_size]) for i in range(0, len(s), chunk_size)], sents)
+        result = {
+            "lang": target,
+            "lines": len(sents),
+            "cpus": os.cpu_count(),
+            "serial_lines_per_sec": serial,
+            "threads": {},
+        }
+        for n in threads:
+            speed = lines_per_sec(lambda s: fs.getlangs_threaded(s, threads=n, chunk_size=chunk_size), sents)
+            result["threads"][n] = {"lines_per_sec": speed, "speedup": speed / serial}
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-t', '--targets', default=",".join(CORPORA), help="Comma-separated target languages")
+    parser.add_argument('-n', '--lines', type=int, default=10000, help="Lines identified per target")
+    parser.add_argument('-j', '--threads', default=",".join(map(str, THREADS)), help="Comma-separated numbers of threads")
+    parser.add_argument('-b', '--chunk_size', type=int, default=250, help="Sentences per getlangs call in each thread")
+    args = parser.parse_args()
+
+    threads = [int(n) for n in args.threads.split(',')]
+    print(json.dumps(run(args.targets.split(','), args.lines, threads, args.chunk_size), indent=2))
+
+
+if __name__ == '__main__':
+    main()
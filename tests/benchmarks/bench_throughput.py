@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+'''
+Throughput benchmark.
+Measures lines per second of each target language over its fixture corpus,
+identifying line by line (getlang) and in batches (getlangs),
+with the default caches and with the spellchecking cache disabled.
+'''
+import argparse
+import json
+import timeit
+
+from fastspell import FastSpell
+from common import CORPORA, load_corpus
+
+
+def lines_per_sec(function, sents, batch_size):
+    start = timeit.default_timer()
+    if batch_size:
+        for i in range(0, len(sents), batch_size):
+            function(sents[i:i+batch_size])
+    else:
+        for sent in sents:
+            function(sent)
+    return len(sents) / (timeit.default_timer() - start)
+
+
+def run(targets=tuple(CORPORA), lines=10000, batch_size=1000):
+    results = []
+    for target in targets:
+        sents = load_corpus(CORPORA[target], lines)
+        for spell_cache_size in (65536, 0):
+            fs = FastSpell(target, mode="cons", spell_cache_size=spell_cache_size)
+            # Warm up, so lazy loading of dictionaries is not measured
+            fs.getlangs(load_corpus(CORPORA[target]))
+            results.append({
+                "lang": target,
+                "spell_cache_size": spell_cache_size,
+                "lines": len(sents),
+                "getlang_lines_per_sec": lines_per_sec(fs.getlang, sents, None),
+                "getlangs_lines_per_sec": lines_per_sec(fs.getlangs, sents, batch_size),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-t', '--targets', default=",".join(CORPORA), help="Comma-separated target languages")
+    parser.add_argument('-n', '--lines', type=int, default=10000, help="Lines identified per target")
+    parser.add_argument('-b', '--batch_size', type=int, default=1000, help="Batch size for getlangs")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.targets.split(','), args.lines, args.batch_size), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+'''
+Tokenizer micro-benchmark.
+Measures tokens/sec of the tokenization done before Hunspell refinement,
+with str.strip over precomputed punctuation (tokenize)
+against a punctuation regex per token (remove_unwanted_words).
+'''
+import argparse
+import json
+import timeit
+
+from fastspell.util import tokenize, remove_unwanted_words, get_punct_chars
+from common import CORPORA, load_corpus
+
+
+def run(lines=5000):
+    # Punctuation table is built on first use, leave it out of the measures
+    get_punct_chars()
+    results = []
+    for target, corpus in CORPORA.items():
+        sents = load_corpus(corpus, lines)
+        num_tokens = sum(len(sent.strip().split(" ")) for sent in sents)
+
+        start = timeit.default_timer()
+        for sent in sents:
+            remove_unwanted_words(sent.strip().split(" "), target)
+        regex_time = timeit.default_timer() - start
+
+        start = timeit.default_timer()
+        for sent in sents:
+            tokenize(sent, target)
+        strip_time = timeit.default_timer() - start
+
+        results.append({
+            "lang": target,
+            "tokens": num_tokens,
+            "tokens_per_sec": {
+                "tokenize": num_tokens / strip_time,
+                "remove_unwanted_words": num_tokens / regex_time,
+            },
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--lines', type=int, default=5000, help="Lines per target language")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.lines), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+'''
+Shared helpers for the FastSpell benchmarks.
+'''
+import os
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# Fixture corpus used for each target language
+CORPORA = {
+    "en": "en",
+    "es": "es",
+    "hbs": "hbs",
+    "nb": "nb",
+    "is": "is",
+    "zh-hans": "zh",
+}
+
+
+def load_corpus(name, lines=None):
+    ''' Read a fixture corpus, repeated up to the requested number of lines '''
+    with open(os.path.join(DATA_DIR, f"{name}.txt"), encoding="utf-8") as corpus_file:
+        sents = [line.rstrip("\n") for line in corpus_file if line.strip()]
+    if lines is None:
+        return sents
+    return [sents[i % len(sents)] for i in range(lines)]
+
+
+def load_labeled(name="labeled"):
+    ''' Read a labeled fixture as (language, sentence) pairs '''
+    with open(os.path.join(DATA_DIR, f"{name}.tsv"), encoding="utf-8") as labeled_file:
+        return [tuple(line.rstrip("\n").split("\t", 1)) for line in labeled_file if line.strip()]
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+'''
+Accuracy of confidence-gated refinement over a labeled fixture.
+Identifies the sentences of data/labeled.tsv (gold language<TAB>sentence)
+for a target language with several skip_confidence and skip_min_words values
+and reports accuracy, precision and recall of the target language, unknown
+labels and skipped refinements, to choose the trade-off for each language
+together with the speed measured by bench_confidence.py.
+'''
+import argparse
+import json
+
+from fastspell import FastSpell
+from common import load_labeled
+from bench_confidence import THRESHOLDS
+
+MIN_WORDS = (0, 5)
+
+
+def evaluate(fs, gold, sents):
+    results = fs.getlangs_scores(sents)
+    labels = [result.label for result in results]
+    predicted = sum(label == fs.lang for label in labels)
+    relevant = sum(lang == fs.lang for lang in gold)
+    correct = sum(label == lang == fs.lang for label, lang in zip(labels, gold))
+    return {
+        "accuracy": sum(label == lang for label, lang in zip(labels, gold)) / len(gold),
+        "precision": correct / predicted if predicted else 0.0,
+        "recall": correct / relevant if relevant else 0.0,
+        "unk": labels.count("unk") / len(gold),
+        "skipped": sum(result.decision == "confident" for result in results) / len(gold),
+    }
+
+
+def run(target="es", mode="cons", thresholds=THRESHOLDS, min_words=MIN_WORDS, fixture="labeled"):
+    gold, sents = zip(*load_labeled(fixture))
+    results = []
+    for i, words in enumerate(min_words):
+        for threshold in thresholds:
+            if not threshold and i:
+                # Not skipping does not depend on the number of words
+                continue
+            fs = FastSpell(target, mode=mode, skip_confidence=threshold, skip_min_words=words)
+            result = {"lang": target, "mode": mode, "skip_confidence": threshold, "skip_min_words": words,
+                      "sentences": len(sents)}
+            result.update(evaluate(fs, gold, sents))
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-l', '--lang', default='es', help="Target language")
+    parser.add_argument('-m', '--mode', choices=("cons", "aggr"), default="cons", help="FastSpell mode")
+    parser.add_argument('-s', '--thresholds', default=",".join(map(str, THRESHOLDS)), help="Comma-separated skip_confidence values")
+    parser.add_argument('-w', '--min_words', default=",".join(map(str, MIN_WORDS)), help="Comma-separated skip_min_words values")
+    parser.add_argument('-f', '--fixture', default="labeled", help="Labeled fixture in data/ (without .tsv)")
+    args = parser.parse_args()
+
+    thresholds = [float(t) for t in args.thresholds.split(',')]
+    min_words = [int(w) for w in args.min_words.split(',')]
+    print(json.dumps(run(args.lang, args.mode, thresholds, min_words, args.fixture), indent=2))
+
+
+if __name__ == '__main__':
+    main()
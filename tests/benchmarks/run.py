@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+'''
+FastSpell benchmark suite runner.
+Runs the benchmarks over the fixture corpora in data/ and writes the results
+as JSON, so they can be compared across releases.
+It runs offline, with the installed FastText model and dictionaries.
+'''
+import platform
+import argparse
+import datetime
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastspell import __version__
+import bench_startup
+import bench_import
+import bench_throughput
+import bench_stages
+import bench_similar
+import bench_compressed
+import bench_script
+import bench_tokenize
+import bench_early_exit
+import bench_threads
+import bench_confidence
+
+BENCHMARKS = {
+    "startup": lambda args: bench_startup.run(repeat=args.repeat),
+    "import": lambda args: bench_import.run(repeat=args.repeat),
+    "throughput": lambda args: bench_throughput.run(lines=args.lines),
+    "stages": lambda args: bench_stages.run(lines=args.lines),
+    "similar": lambda args: bench_similar.run(number=args.lines),
+    "compressed": lambda args: bench_compressed.run(lines=10 * args.lines),
+    "script": lambda args: bench_script.run(lines=4 * args.lines),
+    "tokenize": lambda args: bench_tokenize.run(lines=args.lines),
+    "early_exit": lambda args: bench_early_exit.run(lines=args.lines // 5),
+    "threads": lambda args: bench_threads.run(lines=args.lines),
+    "confidence": lambda args: bench_confidence.run(lines=args.lines),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'), default=sys.stdout, help="Output JSON file")
+    parser.add_argument('-b', '--benchmarks', default=",".join(BENCHMARKS), help="Comma-separated benchmarks to run")
+    parser.add_argument('-n', '--lines', type=int, default=5000, help="Lines per target language")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="Repetitions of the startup and import measures")
+    args = parser.parse_args()
+
+    results = {
+        "fastspell_version": __version__,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "benchmarks": {},
+    }
+    for name in args.benchmarks.split(','):
+        if name not in BENCHMARKS:
+            parser.error(f"Unknown benchmark '{name}'. Available: {', '.join(BENCHMARKS)}")
+        print(f"Running {name} benchmark...", file=sys.stderr)
+        results["benchmarks"][name] = BENCHMARKS[name](args)
+
+    json.dump(results, args.output, indent=2)
+    args.output.write("\n")
+
+
+if __name__ == '__main__':
+    main()
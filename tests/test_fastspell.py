@@ -1,7 +1,28 @@
 import unittest
 import logging
+import json
+import glob
+import asyncio
+import hashlib
+import http.server
+import functools
+import tarfile
+import threading
+import unittest.mock
+import subprocess
+import shutil
+import sys
+import io
+import os
+import tempfile
 
-from fastspell import FastSpell
+from fastspell import FastSpell, MultiFastSpell, Identification
+from fastspell.util import tokenize, remove_unwanted_words, shard_range, seek_line, read_lines_until
+from fastspell.util import default_config_path, load_config, search_hunspell_dict
+from fastspell.fastspell import initialization
+from fastspell.fastspell_compile import compile_dictionary, CompiledDictionary, UnsupportedDictionary, AffixFile, parse_entry, entry_forms
+from fastspell.fastspell_server import FastSpellServer, FastSpellClient, load_targets
+from fastspell.fastspell_download import download_dictionaries, resolve_lang_codes, to_url
 
 class FastSpellTest(unittest.TestCase):
 	@classmethod
@@ -34,3 +55,538 @@ class FastSpellTest(unittest.TestCase):
 			[fs.getlang(line) for line, _ in lines],
 			[lang for _, lang in lines])
 
+
+	def test_batch(self):
+		lines = [
+			'Hello, world',
+			'¿Cómo te llamas? disculpe adiós',
+			'Como te chamas? desculpe adeus',
+			'',
+		]
+
+		fs = FastSpell('es', mode='cons')
+
+		self.assertEqual(
+			fs.getlangs(lines),
+			[fs.getlang(line) for line in lines])
+		self.assertEqual(fs.getlangs([]), [])
+
+	def test_spell_cache(self):
+		line = '¿Cómo te llamas? disculpe adiós'
+
+		fs = FastSpell('es', mode='cons', spell_cache_size=16)
+		nocache = FastSpell('es', mode='cons', spell_cache_size=0)
+
+		self.assertEqual(fs.getlang(line), nocache.getlang(line))
+		fs.getlang(line)
+		self.assertTrue(any(info['hits'] > 0 for info in fs.spell_cache_info().values()))
+		self.assertEqual(nocache.spell_cache_info(), {})
+
+	def test_sent_cache(self):
+		lines = [
+			'Hello, world',
+			'¿Cómo te llamas? disculpe adiós',
+			'Hello, world',
+			'Hello, world\n',
+		]
+
+		fs = FastSpell('es', mode='cons', sent_cache_size=2)
+		nocache = FastSpell('es', mode='cons')
+
+		expected = [nocache.getlang(line) for line in lines]
+		self.assertEqual(fs.getlangs(lines), expected)
+		self.assertEqual([fs.getlang(line) for line in lines], expected)
+		self.assertEqual(fs.cache_info()['sentence']['currsize'], 2)
+		self.assertGreater(fs.cache_info()['sentence']['hits'], 0)
+
+	def test_multi(self):
+		lines = [
+			'Hello, world',
+			'¿Cómo te llamas? disculpe adiós',
+			'Como te chamas? desculpe adeus',
+		]
+		langs = ['es', 'gl', 'en']
+
+		single = [FastSpell(lang, mode='cons') for lang in langs]
+		multi = MultiFastSpell(langs, mode='cons')
+
+		expected = [tuple(fs.getlang(line) for fs in single) for line in lines]
+		self.assertEqual([multi.getlang(line) for line in lines], expected)
+		self.assertEqual(multi.getlangs(lines), expected)
+
+	def test_lazy_dicts(self):
+		line = '¿Cómo te llamas? disculpe adiós'
+
+		lazy = FastSpell('es', mode='cons')
+		eager = FastSpell('es', mode='cons', lazy_dicts=False)
+
+		self.assertEqual(lazy.getlang(line), eager.getlang(line))
+		# Both instances share the same Hunspell objects
+		for l in eager.hunspell_objs:
+			self.assertIs(lazy.hunspell_objs[l], eager.hunspell_objs[l])
+
+	def test_stats(self):
+		lines = [
+			'Hello, world',
+			'¿Cómo te llamas? disculpe adiós',
+		]
+
+		fs = FastSpell('es', mode='cons', stats=True)
+		nostats = FastSpell('es', mode='cons')
+
+		self.assertEqual(fs.getlangs(lines), nostats.getlangs(lines))
+		self.assertIsNone(nostats.get_stats())
+		stats = fs.get_stats()
+		self.assertEqual(stats['sentences'], 2)
+		self.assertEqual(stats['refined'], 1)
+		self.assertEqual(sum(stats['decisions'].values()), 1)
+		self.assertGreater(stats['spellchecked_tokens']['es'], 0)
+
+	def test_getscript(self):
+		fs = FastSpell('en', mode='cons')
+
+		self.assertEqual(fs.getscript('Dobar dan, kako ste?', 'hbs'), 'hbs_lat')
+		self.assertEqual(fs.getscript('Добар дан, како сте?', 'hbs'), 'hbs_cyr')
+		self.assertEqual(fs.getscript('Dobar dan', 'sr'), 'sr_lat')
+		self.assertEqual(fs.getscript('Добар дан', 'me'), 'me_cyr')
+		# Ties go to the first script
+		self.assertEqual(fs.getscript('123', 'hbs'), 'hbs_lat')
+
+	def test_tokenize(self):
+		# Benchmark fixtures in several languages and scripts
+		data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'data')
+		lines = [
+			'¿Cómo te llamas? «disculpe» adiós...',
+			'  "Hello,   world!" -- (test) 123 ¡¿ ¡hola?! ',
+			'Das ist ein Test. Übermorgen, 3x',
+		]
+		for path in sorted(glob.glob(os.path.join(data_dir, '*.txt'))):
+			with open(path, encoding='utf-8') as fixture:
+				lines.extend(fixture.read().splitlines())
+
+		for lang in ('en', 'de', 'hbs'):
+			for line in lines:
+				self.assertEqual(tokenize(line, lang), remove_unwanted_words(line.strip().split(" "), lang))
+
+	def test_early_exit(self):
+		lines = [
+			'Hello, world',
+			'¿Cómo te llamas? disculpe adiós',
+			'Bos días, como estás? Hoxe vai moito frío na rúa.',
+			'El gato está durmiendo en la mesa de la cocina desde esta mañana. ' * 5,
+		]
+
+		fs = FastSpell('es', mode='cons', stats=True)
+		early = FastSpell('es', mode='cons', early_exit=True, stats=True)
+		capped = FastSpell('es', mode='cons', max_tokens=5, stats=True)
+
+		self.assertEqual(early.getlangs(lines), fs.getlangs(lines))
+		self.assertLessEqual(early.get_stats()['spellchecked_tokens']['gl'], fs.get_stats()['spellchecked_tokens']['gl'])
+		capped.getlangs(lines)
+		self.assertLessEqual(capped.get_stats()['spellchecked_tokens']['es'], 5 * capped.get_stats()['refined'])
+
+	def test_compiled_dict(self):
+		aff = '\n'.join([
+			'SET UTF-8',
+			'FORBIDDENWORD !',
+			'SFX S Y 2',
+			'SFX S 0 s [^s]',
+			'SFX S 0 es s',
+			'PFX R Y 1',
+			'PFX R 0 re .',
+		])
+		dic = '\n'.join(['6', 'casa/S', 'gas/S', 'hacer/RS', 'OpenOffice', 'Madrid', 'gass/!'])
+
+		with tempfile.TemporaryDirectory() as tmpdir:
+			dicpath = os.path.join(tmpdir, 'xx_XX')
+			with open(dicpath + '.aff', 'w', encoding='utf-8') as aff_file:
+				aff_file.write(aff + '\n')
+			with open(dicpath + '.dic', 'w', encoding='utf-8') as dic_file:
+				dic_file.write(dic + '\n')
+			path, num_forms = compile_dictionary(dicpath, tmpdir)
+			compiled = CompiledDictionary(path)
+
+			self.assertTrue(compiled.matches(dicpath))
+			correct = ['casa', 'casas', 'Casas', 'CASAS', 'gases', 'rehacer', 'rehacers',
+				'OpenOffice', 'OPENOFFICE', 'Madrid', 'MADRID', 'casa-gas', '12.5']
+			wrong = ['casaz', 'gass', 'Openoffice', 'madrid', 'cAsa', 'casa-gaz', '1..2']
+			for word in correct:
+				self.assertTrue(compiled.spell(word), word)
+			for word in wrong:
+				self.assertFalse(compiled.spell(word), word)
+			compiled.close()
+
+	def fixture_tokens(self):
+		''' Tokens of the benchmark fixture corpora, as spellchecked and as in the text, in several cases '''
+		data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'data')
+		tokens = set()
+		for path in sorted(glob.glob(os.path.join(data_dir, '*.txt')) + glob.glob(os.path.join(data_dir, '*.tsv'))):
+			lang = os.path.basename(path).split('.')[0]
+			with open(path, encoding='utf-8') as f:
+				for line in f:
+					line = line.rstrip('\n').split('\t')[-1]
+					tokens.update(tokenize(line, lang))
+					tokens.update(line.split())
+		return sorted(token for token in tokens | {t.upper() for t in tokens} | {t.capitalize() for t in tokens} if token)
+
+	def test_compiled_parity(self):
+		import hunspell
+		dicpath = search_hunspell_dict('es_ES', load_config()[2])
+		with tempfile.TemporaryDirectory() as tmpdir:
+			path, num_forms = compile_dictionary(dicpath, tmpdir)
+			compiled = CompiledDictionary(path)
+			speller = hunspell.Hunspell('es_ES', hunspell_data_dir=os.path.dirname(dicpath))
+			for token in self.fixture_tokens():
+				try:
+					expected = speller.spell(token)
+				except UnicodeEncodeError:
+					# Not in the dictionary encoding, FastSpell takes it as misspelled
+					expected = False
+				self.assertEqual(compiled.spell(token), expected, token)
+			compiled.close()
+
+			# FastSpell uses the compiled dictionary when it is in a dictionary path
+			config_path = os.path.join(tmpdir, 'config')
+			shutil.copytree(default_config_path(), config_path)
+			with open(os.path.join(config_path, 'hunspell.yaml'), encoding='utf-8') as f:
+				hunspell_yaml = f.read()
+			with open(os.path.join(config_path, 'hunspell.yaml'), 'w', encoding='utf-8') as f:
+				f.write(hunspell_yaml.replace('dictpath: ""', f'dictpath: "{tmpdir}"'))
+			fs = FastSpell('es', mode='cons', config_path=config_path, spell_backend='compiled', lazy_dicts=False)
+			self.assertIsInstance(fs.hunspell_objs['es'], CompiledDictionary)
+			with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'data', 'es.txt'), encoding='utf-8') as f:
+				lines = f.readlines()
+			self.assertEqual(fs.getlangs(lines), FastSpell('es', mode='cons').getlangs(lines))
+
+	def sample_dictionary(self, code, dest, entries=400):
+		''' Copy of a dictionary with one in every few of its entries, and the same affix file '''
+		dicpath = search_hunspell_dict(code, load_config()[2])
+		shutil.copy(dicpath + '.aff', os.path.join(dest, code + '.aff'))
+		with open(dicpath + '.dic', 'rb') as f:
+			lines = f.read().splitlines()[1:]
+		lines = lines[::max(1, len(lines) // entries)]
+		with open(os.path.join(dest, code + '.dic'), 'wb') as f:
+			f.write(b'%d\n' % len(lines) + b'\n'.join(lines) + b'\n')
+		return os.path.join(dest, code)
+
+	def test_compiled_parity_affixes(self):
+		import hunspell
+		# BREAK (ca_ES, uk_UA), ICONV and IGNORE (uk_UA, ar), AF with FLAG long (ar) and num (tk), NEEDAFFIX (tk),
+		# FULLSTRIP (sr_RS_lat), ONLYUPCASE hidden homonyms (pt_PT)
+		for code in ('ca_ES', 'pt_PT', 'sr_RS_lat', 'tk', 'uk_UA', 'ar'):
+			with self.subTest(code=code), tempfile.TemporaryDirectory() as tmpdir:
+				dicpath = self.sample_dictionary(code, tmpdir)
+				path, num_forms = compile_dictionary(dicpath, tmpdir)
+				compiled = CompiledDictionary(path)
+				speller = hunspell.Hunspell(code, hunspell_data_dir=tmpdir)
+
+				aff = AffixFile(dicpath + '.aff')
+				words = []
+				with open(dicpath + '.dic', encoding=aff.encoding) as f:
+					next(f)
+					for line in f:
+						entry = parse_entry(aff, line)
+						if entry is not None:
+							forms = sorted({form for form, kind in entry_forms(aff, *entry) if '\0' not in form})
+							words.extend(forms[:2] + forms[-2:] + [entry[0]])
+				tokens = {'bon-dia', 'Bon-dia', 'BON-DIA', '1', '1.000', '1.000,5', '12-3', '-5', '3.', 'A4', '.', '...'}
+				for i, word in enumerate(words):
+					other = words[i * 7919 % len(words)]
+					tokens.update((word, word.upper(), word.capitalize(), word + '.', word[:-1], word + '-' + other, word + '-'))
+				for token in sorted(tokens):
+					try:
+						expected = speller.spell(token)
+					except UnicodeEncodeError:
+						expected = False
+					self.assertEqual(compiled.spell(token), expected, token)
+				compiled.close()
+
+	def test_compile_limits(self):
+		with tempfile.TemporaryDirectory() as tmpdir:
+			dicpath = self.sample_dictionary('ca_ES', tmpdir)
+			with self.assertRaises(UnsupportedDictionary):
+				compile_dictionary(dicpath, tmpdir, max_forms=1000)
+			self.assertEqual(sorted(os.listdir(tmpdir)), ['ca_ES.aff', 'ca_ES.dic'])
+
+			# Word forms sorted in several runs on disk give the same dictionary
+			path, num_forms = compile_dictionary(dicpath, tmpdir)
+			with open(path, 'rb') as f:
+				one_run = f.read()
+			with unittest.mock.patch('fastspell.fastspell_compile.RUN_SIZE', 1000):
+				self.assertEqual(compile_dictionary(dicpath, tmpdir), (path, num_forms))
+			with open(path, 'rb') as f:
+				self.assertEqual(f.read(), one_run)
+
+	def test_trace(self):
+		lines = [
+			'Hello, world',
+			'¿Cómo te llamas? disculpe adiós',
+		]
+
+		trace = io.StringIO()
+		fs = FastSpell('es', mode='cons', trace=trace)
+		notrace = FastSpell('es', mode='cons')
+
+		self.assertEqual(fs.getlangs(lines), notrace.getlangs(lines))
+		records = [json.loads(r) for r in trace.getvalue().splitlines()]
+		self.assertEqual(len(records), 2)
+		self.assertEqual(records[0]['decision'], 'fasttext')
+		self.assertIsNone(records[0]['tokens'])
+		self.assertEqual(records[1]['label'], 'es')
+		self.assertIn('es', records[1]['error_rates'])
+
+	def test_server(self):
+		lines = [
+			'Hello, world',
+			'¿Cómo te llamas? disculpe adiós',
+			'Como te chamas? desculpe adeus',
+		]
+		targets = load_targets(['es', 'gl,en'], mode='cons')
+		expected = {lang: fs.getlangs(lines) for lang, fs in targets.items()}
+		expected = {lang: [list(l) if isinstance(l, tuple) else l for l in labels]
+				for lang, labels in expected.items()}
+
+		loop = asyncio.new_event_loop()
+		thread = threading.Thread(target=loop.run_forever, daemon=True)
+		thread.start()
+		server = FastSpellServer(targets, batch_size=4, max_latency=0.01)
+		with tempfile.TemporaryDirectory() as tmpdir:
+			path = os.path.join(tmpdir, 'fastspell.sock')
+			asyncio.run_coroutine_threadsafe(server.start(socket_path=path), loop).result()
+
+			results = {}
+			def request(i):
+				lang = ['es', 'gl,en'][i % 2]
+				with FastSpellClient(socket_path=path) as client:
+					results[i] = (client.getlangs(lines, lang), client.getlang(lines[i % 3], lang))
+			clients = [threading.Thread(target=request, args=(i,)) for i in range(8)]
+			for t in clients:
+				t.start()
+			for t in clients:
+				t.join()
+
+			for i, (labels, label) in results.items():
+				lang = ['es', 'gl,en'][i % 2]
+				self.assertEqual(labels, expected[lang])
+				self.assertEqual(label, expected[lang][i % 3])
+			self.assertEqual(len(results), 8)
+
+			with FastSpellClient(socket_path=path) as client:
+				with self.assertRaises(RuntimeError):
+					client.getlang('Hello', 'xx')
+
+				# Batches above the default 64 KiB stream limit
+				big = lines * 2000
+				self.assertEqual(client.getlangs(big, 'es'), expected['es'] * 2000)
+			asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+
+			# Requests over the limit get an error and the connection keeps working
+			server = FastSpellServer(targets, max_request_size=1000)
+			asyncio.run_coroutine_threadsafe(server.start(socket_path=path), loop).result()
+			with FastSpellClient(socket_path=path) as client:
+				with self.assertRaises(RuntimeError):
+					client.getlangs(big, 'es')
+				self.assertEqual(client.getlangs(lines, 'es'), expected['es'])
+			asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+		loop.call_soon_threadsafe(loop.stop)
+		thread.join()
+
+	def test_shards(self):
+		lines = [b'Hello, world\n', b'\n', b'\xc2\xbfC\xc3\xb3mo te llamas?\n', b'a\n', b'Como te chamas?']
+		data = b''.join(lines)
+		with tempfile.TemporaryFile() as f:
+			f.write(data)
+			for total in range(1, len(data) + 2):
+				# Every line is read by exactly one shard
+				shards = []
+				for index in range(1, total + 1):
+					start, end = shard_range(len(data), index, total)
+					shards.extend(read_lines_until(f, seek_line(f, start), end))
+				self.assertEqual(shards, lines)
+			self.assertEqual(seek_line(f, 14), 14)
+			self.assertEqual(seek_line(f, 15), 33)
+
+	def test_cli_args(self):
+		with tempfile.TemporaryDirectory() as tmpdir:
+			input_path = os.path.join(tmpdir, 'bitextor.tsv')
+			open(input_path, 'w').close()
+			# Options can go anywhere, also between the language and the files
+			for argv in (['--cons', 'es', '-f', '3', input_path, 'out.tsv'],
+					['--cons', '-f', '3', 'es', input_path, 'out.tsv'],
+					['es', input_path, 'out.tsv', '--cons', '-f', '3']):
+				with unittest.mock.patch.object(sys, 'argv', ['fastspell'] + argv):
+					args = initialization()
+				self.assertEqual((args.lang, args.input, args.output, args.field, args.cons), ('es', input_path, 'out.tsv', 3, True))
+
+	def test_threads(self):
+		lines = [
+			'Hello, world',
+			'¿Cómo te llamas? disculpe adiós',
+			'Como te chamas? desculpe adeus',
+		] * 50
+
+		fs = FastSpell('es', mode='cons', sent_cache_size=10, stats=True)
+		expected = FastSpell('es', mode='cons').getlangs(lines)
+		self.assertEqual(fs.getlangs_threaded(lines, threads=4, chunk_size=7), expected)
+		stats = fs.get_stats()
+		self.assertEqual(stats['cache']['sentence']['hits'] + stats['cache']['sentence']['misses'], len(lines))
+
+		# Identification does not change the instance
+		fs = FastSpell('zh-hans', mode='cons')
+		fs.getlang('我们的国家是一个伟大的国家')
+		self.assertFalse(fs.script)
+
+	def test_scores(self):
+		lines = [
+			'Hello, world',
+			'¿Cómo te llamas? disculpe adiós',
+		]
+
+		fs = FastSpell('es', mode='cons')
+		results = fs.getlangs_scores(lines, k=3)
+		self.assertEqual([r.label for r in results], fs.getlangs(lines))
+		self.assertIsInstance(results[0], Identification)
+		self.assertEqual(len(results[0].candidates), 3)
+		self.assertEqual(results[0].candidates[0], (results[0].prediction, results[0].probability))
+		self.assertEqual(results[0].error_rates, {})
+		self.assertIn('es', results[1].error_rates)
+		self.assertEqual(fs.getlang_scores(lines[1], k=3), results[1])
+
+		multi = MultiFastSpell(['es', 'gl'], mode='cons')
+		self.assertEqual([tuple(r.label for r in rs) for rs in multi.getlangs_scores(lines)],
+				multi.getlangs(lines))
+
+	def test_skip_confidence(self):
+		lines = [
+			'Hello, world',
+			'¿Cómo te llamas? disculpe adiós',
+			'Como te chamas? desculpe adeus',
+		]
+
+		fs = FastSpell('es', mode='cons')
+		expected = fs.getlangs(lines)
+		# Long enough sentences are never skipped
+		self.assertEqual(FastSpell('es', mode='cons', skip_confidence=1e-6, skip_min_words=100).getlangs(lines), expected)
+
+		# Any probability is enough: FastText predictions are kept as they are
+		skipping = FastSpell('es', mode='cons', skip_confidence=1e-6)
+		results = skipping.getlangs_scores(lines)
+		self.assertEqual([r.label for r in results], [r.prediction for r in results])
+		self.assertEqual([r.decision for r in results if r.prediction in ('es', 'gl', 'ca', 'ast')],
+				['confident'] * sum(r.prediction in ('es', 'gl', 'ca', 'ast') for r in results))
+		self.assertEqual([skipping.getlang(line) for line in lines], skipping.getlangs(lines))
+
+	def test_download(self):
+		similar = {'es': ['gl', 'ca'], 'gl': ['es', 'pt']}
+		codes = {'es': 'es_ES', 'gl': 'gl_ES', 'ca': 'ca_ES', 'pt': 'pt_PT'}
+		self.assertEqual(resolve_lang_codes(['es'], similar, codes), {'gl': 'gl_ES', 'ca': 'ca_ES', 'es': 'es_ES'})
+
+		with tempfile.TemporaryDirectory() as mirror, tempfile.TemporaryDirectory() as dest:
+			files = {f'{code}.{ext}': f'{code} {ext}\n'.encode() for code in codes.values() for ext in ('dic', 'aff')}
+			for name, data in files.items():
+				with open(os.path.join(mirror, name), 'wb') as f:
+					f.write(data)
+			with open(os.path.join(mirror, 'SHA256SUMS'), 'w') as f:
+				for name, data in files.items():
+					f.write(f'{hashlib.sha256(data).hexdigest()}  {name}\n')
+
+			# Local HTTP stand-in of a mirror
+			handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=mirror)
+			handler.log_message = lambda *args: None
+			server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+			threading.Thread(target=server.serve_forever, daemon=True).start()
+			url = f'http://127.0.0.1:{server.server_address[1]}/'
+			try:
+				needed = resolve_lang_codes(['es'], similar, codes)
+				self.assertEqual(download_dictionaries(dest, needed, url=url), [])
+				self.assertEqual(sorted(os.listdir(dest)), ['ca_ES.aff', 'ca_ES.dic', 'es_ES.aff', 'es_ES.dic', 'gl_ES.aff', 'gl_ES.dic'])
+				with open(os.path.join(dest, 'gl_ES.dic'), 'rb') as f:
+					self.assertEqual(f.read(), files['gl_ES.dic'])
+
+				# Corrupted files are not installed
+				with open(os.path.join(mirror, 'pt_PT.dic'), 'wb') as f:
+					f.write(b'corrupted')
+				self.assertEqual(download_dictionaries(dest, {'pt': 'pt_PT'}, url=url), ['pt_PT'])
+				self.assertFalse(any(name.startswith('pt_PT') or name.endswith('.tmp') for name in os.listdir(dest)))
+			finally:
+				server.shutdown()
+				server.server_close()
+
+			# Archive from a local path, only the missing dictionaries are installed
+			archive = os.path.join(mirror, 'dicts.tgz')
+			with tarfile.open(archive, 'w:gz') as tar:
+				for name in list(files) + ['SHA256SUMS']:
+					tar.add(os.path.join(mirror, name), arcname=name)
+			os.remove(os.path.join(dest, 'es_ES.dic'))
+			self.assertEqual(download_dictionaries(dest, codes, url=archive), ['pt_PT'])
+			self.assertTrue(os.path.exists(os.path.join(dest, 'es_ES.dic')))
+
+			# Archives without checksums file are only installed if verified as a whole, or if insecure
+			unverified = os.path.join(mirror, 'unverified.tgz')
+			with tarfile.open(unverified, 'w:gz') as tar:
+				tar.add(os.path.join(mirror, 'ca_ES.aff'), arcname='ca_ES.aff')
+				tar.add(os.path.join(mirror, 'ca_ES.dic'), arcname='ca_ES.dic')
+			with open(unverified, 'rb') as f:
+				archive_hash = hashlib.sha256(f.read()).hexdigest()
+			os.remove(os.path.join(dest, 'ca_ES.dic'))
+			with self.assertRaises(RuntimeError):
+				download_dictionaries(dest, {'ca': 'ca_ES'}, url=unverified)
+			with self.assertRaises(RuntimeError):
+				download_dictionaries(dest, {'ca': 'ca_ES'}, url=unverified, sha256='0' * 64)
+			self.assertFalse(os.path.exists(os.path.join(dest, 'ca_ES.dic')))
+			self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(dest)))
+			self.assertEqual(download_dictionaries(dest, {'ca': 'ca_ES'}, url=unverified, sha256=archive_hash), [])
+			os.remove(os.path.join(dest, 'ca_ES.dic'))
+			self.assertEqual(download_dictionaries(dest, {'ca': 'ca_ES'}, url=unverified, insecure=True), [])
+			self.assertTrue(os.path.exists(os.path.join(dest, 'ca_ES.dic')))
+
+			# The release archive is verified against its pinned checksum, also local copies of it
+			with unittest.mock.patch('fastspell.fastspell_download.DICTIONARIES_URL', to_url(unverified)), \
+					unittest.mock.patch('fastspell.fastspell_download.DICTIONARIES_SHA256', archive_hash):
+				self.assertEqual(download_dictionaries(dest, {'ca': 'ca_ES'}, force=True), [])
+				self.assertEqual(download_dictionaries(dest, {'ca': 'ca_ES'}, force=True, url=unverified), [])
+			with unittest.mock.patch('fastspell.fastspell_download.DICTIONARIES_URL', to_url(unverified)), \
+					unittest.mock.patch('fastspell.fastspell_download.DICTIONARIES_SHA256', '0' * 64):
+				with self.assertRaises(RuntimeError):
+					download_dictionaries(dest, {'ca': 'ca_ES'}, force=True, insecure=True)
+
+			# Files extracted before a broken member are removed
+			truncated = os.path.join(mirror, 'truncated.tgz')
+			with tarfile.open(truncated, 'w') as tar:
+				tar.add(os.path.join(mirror, 'ca_ES.aff'), arcname='ca_ES.aff')
+				info = tarfile.TarInfo('ca_ES.dic')
+				info.size = 1 << 20
+				tar.addfile(info, io.BytesIO(bytes(info.size)))
+			os.truncate(truncated, 1 << 19)
+			os.remove(os.path.join(dest, 'ca_ES.dic'))
+			with self.assertRaises(tarfile.TarError):
+				download_dictionaries(dest, {'ca': 'ca_ES'}, url=truncated, insecure=True)
+			self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(dest)))
+
+	def test_config_cache(self):
+		with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as tmp, \
+				unittest.mock.patch.dict(os.environ, {'FASTSPELL_CACHE_DIR': cache_dir}):
+			config_path = os.path.join(tmp, 'config')
+			shutil.copytree(default_config_path(), config_path)
+			config = load_config(config_path)
+			self.assertTrue(glob.glob(os.path.join(cache_dir, 'yaml-*.json')))
+			self.assertEqual(load_config(config_path), config)
+
+			# Changed files are parsed again
+			with open(os.path.join(config_path, 'similar.yaml'), 'a') as f:
+				f.write('    xx: [es]\n')
+			self.assertEqual(load_config(config_path)[0]['xx'], ['es'])
+
+			# Dictionary paths are resolved again when a directory changes
+			dicts = os.path.join(tmp, 'dicts')
+			os.mkdir(dicts)
+			with self.assertRaises(RuntimeError):
+				search_hunspell_dict('xx_XX', [dicts])
+			for ext in ('dic', 'aff'):
+				open(os.path.join(dicts, f'xx_XX.{ext}'), 'w').close()
+			self.assertEqual(search_hunspell_dict('xx_XX', [dicts]), f'{dicts}/xx_XX')
+
+		# Slow dependencies are not imported until they are used
+		loaded = subprocess.run([sys.executable, '-c', 'import sys, fastspell; print(" ".join(m for m in ("fasttext", "hunspell", "hanzidentifier", "regex", "yaml") if m in sys.modules))'],
+			check=True, capture_output=True, text=True).stdout
+		self.assertEqual(loaded.strip(), '')